@@ -11,3 +11,4 @@ CREATE TABLE uma_rating_04
     PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum)
 );
 
+CREATE INDEX IF NOT EXISTS uma_rating_04_kettonum_idx ON uma_rating_04 (KettoNum, Year, MonthDay);
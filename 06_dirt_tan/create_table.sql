@@ -11,3 +11,4 @@ CREATE TABLE uma_rating_06
     PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum)
 );
 
+CREATE INDEX IF NOT EXISTS uma_rating_06_kettonum_idx ON uma_rating_06 (KettoNum, Year, MonthDay);
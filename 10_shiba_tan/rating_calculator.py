@@ -2,8 +2,12 @@
 
 import numpy as np
 import os
+import sys
+import time
 import psycopg2
 import datetime
+import io
+import itertools
 from tqdm import tqdm
 
 target_table='uma_rating_10'
@@ -16,16 +20,16 @@ class IDFilter:
 class IDFilterUntilToday:
     @classmethod
     def generate_phrase(cls, id):
-        return " concat(year, monthday)<'%s'" % (id[0] + id[1],)
+        return " (year, monthday)<('%s', '%s')" % (id[0], id[1])
 
 class DateFilter:
     @classmethod
     def generate_condition_older(cls, yearmonthday):
-        return " concat(year, monthday)>='%s'" % yearmonthday
+        return " (year, monthday)>=('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
 
     @classmethod
     def generate_condition_newer(cls, yearmonthday):
-        return " concat(year, monthday)<='%s'" % yearmonthday
+        return " (year, monthday)<=('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
 
 class SelectPhrase:
     @classmethod
@@ -43,10 +47,17 @@ class SelectPhrase:
 
         return query
 
-class InsertPhrase:
+class StoredRating:
+    @classmethod
+    def generate(self, rating):
+        # same value the SMALLINT column would hold after an INSERT of '%.1f'
+        rounded = float('%.1f' % rating)
+        return int(rounded + 0.5) if rounded >= 0 else -int(-rounded + 0.5)
+
+class CopyPhrase:
     @classmethod
     def generate(self, id, kettonum, rating):
-        return "INSERT INTO %s VALUES('%s', '%s', '%s', '%s', '%s', '%s', '%s', %.1f);" % ((target_table,) + id + (kettonum,) + (rating,))
+        return '\t'.join(id + (kettonum, '%d' % StoredRating.generate(rating))) + '\n'
 
 class IDListReference:
     def __init__(self, fromyearmonthday, toyearmonthday):
@@ -57,38 +68,29 @@ class IDListReference:
         self.limit      = ''
         #self.limit      = '3'
 
-class RaceInfoReference:
-    def __init__(self, id):
-        self.table      = 'n_race'
-        self.cols       = 'trackcd'
-        self.conditions = IDFilter.generate_phrase(id) + " AND datakubun='7'"
-        self.order      = 'year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC'
-        self.limit      = ''
-        #self.limit      = '3'
-
-class HorseInfoReference:
-    __cols = 'umaban, kettonum, sexcd, kisyucode, futan, bataijyu, zogenfugo, zogensa, ijyocd, kakuteijyuni'
+class RaceEntryReference:
+    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, trackcd, kettonum, ijyocd, kakuteijyuni'
 
-    def __init__(self, id):
-        self.table      = 'n_uma_race'
-        self.cols       = HorseInfoReference.__cols
-        self.conditions = IDFilter.generate_phrase(id) + " AND datakubun='7'"
-        self.order      = 'kettonum DESC'
+    def __init__(self, fromyearmonthday, toyearmonthday):
+        self.table      = 'n_race JOIN n_uma_race USING (year, monthday, jyocd, kaiji, nichiji, racenum)'
+        self.cols       = RaceEntryReference.__cols
+        self.conditions = "n_race.datakubun='7' AND n_uma_race.datakubun='7'" + ' AND' + DateFilter.generate_condition_older(fromyearmonthday) + ' AND' + DateFilter.generate_condition_newer(toyearmonthday)
+        self.order      = 'year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC, kaiji ASC, kettonum DESC'
         self.limit      = ''
 
     @classmethod
     def index(self, colname):
         return self.__cols.strip().split(', ').index(colname)
 
-class RatingReference:
-    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, rating'
+class LatestRatingReference:
+    __cols = 'kettonum, rating'
 
-    def __init__(self, id, kettonum):
+    def __init__(self, yearmonthday):
         self.table      = target_table
-        self.cols       = RatingReference.__cols
-        self.conditions = "kettonum='%s'" % kettonum + ' AND' + IDFilterUntilToday.generate_phrase(id)
-        self.order      = 'year DESC, monthday DESC'
-        self.limit      = '3'
+        self.cols       = 'DISTINCT ON (kettonum) ' + LatestRatingReference.__cols
+        self.conditions = IDFilterUntilToday.generate_phrase((yearmonthday[:4], yearmonthday[4:]))
+        self.order      = 'kettonum, year DESC, monthday DESC'
+        self.limit      = ''
 
     @classmethod
     def index(self, colname):
@@ -97,107 +99,139 @@ class RatingReference:
 class RatingExistanceReference:
     __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, kettonum, rating'
 
-    def __init__(self, id):
+    def __init__(self, fromyearmonthday):
         self.table      = target_table
         self.cols       = RatingExistanceReference.__cols
-        self.conditions = IDFilter.generate_phrase(id)
-        self.order      = ''
+        self.conditions = DateFilter.generate_condition_older(fromyearmonthday)
+        self.order      = 'year ASC, monthday ASC'
         self.limit      = ''
 
     @classmethod
     def index(self, colname):
         return self.__cols.strip().split(', ').index(colname)
 
-class IDReader:
-    @classmethod
-    def load_data(self, fromyear, toyear, connection):
-        with connection.cursor('id_cursor') as cur:
-            query = SelectPhrase.generate(IDListReference(fromyear, toyear))
-            cur.execute(query)
-            id_list  = cur.fetchall()
-
-        return id_list
-
 class CurrentRatingReader:
+    itersize = 50000
+
     @classmethod
-    def load_data(self, id, connection):
+    def load_data(self, fromyearmonthday, rating_state, connection):
+        # races are written in order, so the computed ones are a prefix of the run
+        # and folding their ratings into rating_state leaves it ready for the rest
+        id_set = set()
+
         with connection.cursor('current_rating_reader') as cur:
-            query = SelectPhrase.generate(RatingExistanceReference(id))
+            cur.itersize = self.itersize
+            query = SelectPhrase.generate(RatingExistanceReference(fromyearmonthday))
             cur.execute(query)
-            id_list  = cur.fetchall()
 
-        return id_list
+            for row in cur:
+                id_set.add(tuple(row[:6]))
+                rating_state.update([row[RatingExistanceReference.index('kettonum')]],
+                                    [row[RatingExistanceReference.index('rating')]])
 
-class TrackcdReader:
+        return id_set
+
+class RaceCountReader:
     @classmethod
-    def load_data(self, id, connection):
-        with connection.cursor('uma_cursor') as cur:
-            query = "select trackcd from n_race where %s AND datakubun='7'" % (IDFilter.generate_phrase(id),)
-            cur.execute(query)
+    def load_data(self, fromyearmonthday, toyearmonthday, connection):
+        reference = IDListReference(fromyearmonthday, toyearmonthday)
+        reference.cols  = 'count(*)'
+        reference.order = ''
+
+        with connection.cursor() as cur:
+            cur.execute(SelectPhrase.generate(reference))
             row = cur.fetchone()
 
         return row[0]
 
-class UmaReader:
+class RaceReader:
+    itersize = 50000
+
     @classmethod
     def __analyze(self, rows):
         kakuteijyuni_list = list()
         kettonum_list = list()
 
         for row in rows:
-            if row[HorseInfoReference.index('ijyocd')] != '0':
+            if row[RaceEntryReference.index('ijyocd')] != '0':
                 continue
-            kettonum_list.append( row[HorseInfoReference.index('kettonum')] )
-            kakuteijyuni_list.append( row[HorseInfoReference.index('kakuteijyuni')] )
+            kettonum_list.append( row[RaceEntryReference.index('kettonum')] )
+            kakuteijyuni_list.append( row[RaceEntryReference.index('kakuteijyuni')] )
 
         return kettonum_list, kakuteijyuni_list
 
     @classmethod
-    def load_data(self, id, connection):
-        with connection.cursor('uma_cursor') as cur:
-            # Get race specific uma info from n_race_uma
-            query = SelectPhrase.generate(HorseInfoReference(id))
+    def load_data(self, fromyearmonthday, toyearmonthday, connection):
+        with connection.cursor('race_cursor') as cur:
+            cur.itersize = self.itersize
+            query = SelectPhrase.generate(RaceEntryReference(fromyearmonthday, toyearmonthday))
             cur.execute(query)
-            horse_info_list = cur.fetchall()
 
-            kettonum_list, kakuteijyuni_list = UmaReader.__analyze(horse_info_list)
+            for id, rows in itertools.groupby(cur, key=lambda row: tuple(row[:6])):
+                rows = list(rows)
+                trackcd = rows[0][RaceEntryReference.index('trackcd')]
+                kettonum_list, kakuteijyuni_list = RaceReader.__analyze(rows)
 
-        return kettonum_list, kakuteijyuni_list
+                yield id, trackcd, kettonum_list, kakuteijyuni_list
 
-class RatingReader:
-    @classmethod
-    def __estimate_current_rating(self, rating_history):
-        if not rating_history:
-            return 1400
-        return rating_history[0][RatingReference.index('rating')]
+class RatingState:
+    initial_rating = 1400
 
-    @classmethod
-    def load_data(self, id, kettonum_list, connection):
-        rating_list = list()
+    def __init__(self):
+        self.rating_dict = dict()
 
-        for kettonum in kettonum_list:
-            with connection.cursor('rating_cursor') as cur:
-                query = SelectPhrase.generate(RatingReference(id, kettonum))
-                cur.execute(query)
-                rating_history = cur.fetchall()
+    def load_data(self, fromyearmonthday, connection):
+        with connection.cursor('rating_state_cursor') as cur:
+            query = SelectPhrase.generate(LatestRatingReference(fromyearmonthday))
+            cur.execute(query)
+            for row in cur:
+                kettonum = row[LatestRatingReference.index('kettonum')]
+                self.rating_dict[kettonum] = row[LatestRatingReference.index('rating')]
 
-            rating = RatingReader.__estimate_current_rating(rating_history)
-            rating_list.append(rating)
+    def get(self, kettonum_list):
+        return [self.rating_dict.get(kettonum, self.initial_rating) for kettonum in kettonum_list]
 
-        return rating_list
+    def update(self, kettonum_list, rating_list):
+        for kettonum, rating in zip(kettonum_list, rating_list):
+            self.rating_dict[kettonum] = StoredRating.generate(rating)
 
 class RatingWriter:
-    @classmethod
-    def write_data(self, id, kettonum_list, rating_list, connection):
+    flush_threshold = 20000
+
+    def __init__(self, connection, flush_threshold=None):
+        self.connection = connection
+        self.flush_threshold = flush_threshold or RatingWriter.flush_threshold
+        self.buffer = io.StringIO()
+        self.row_count = 0
+
+    def write_data(self, id, kettonum_list, rating_list):
         for kettonum, rating in zip(kettonum_list, rating_list):
-            with connection.cursor() as cur:
-                query = InsertPhrase.generate(id, kettonum, rating)
-                cur.execute(query)
-        connection.commit()
+            self.buffer.write(CopyPhrase.generate(id, kettonum, rating))
+            self.row_count += 1
+
+        if self.row_count >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.row_count == 0:
+            return
+
+        self.buffer.seek(0)
+        with self.connection.cursor() as cur:
+            cur.copy_expert('COPY %s FROM STDIN' % target_table, self.buffer)
+        self.connection.commit()
+
+        self.buffer = io.StringIO()
+        self.row_count = 0
 
 class RatingCalculator:
+    vectorized = False
+
     @classmethod
     def estimate(self, rating_list, kakuteijyuni_list):
+        if self.vectorized:
+            return self.estimate_vectorized(rating_list, kakuteijyuni_list)
+
         assert(len(rating_list) == len(kakuteijyuni_list))
 
         new_rating_list = list(rating_list)
@@ -285,6 +319,65 @@ class RatingCalculator:
 
         return new_rating_list
 
+    @classmethod
+    def __rating_at(self, rating, jyuni, target):
+        index = np.flatnonzero(jyuni == target)
+        return rating[index[-1]] if len(index) else 0
+
+    @classmethod
+    def estimate_vectorized(self, rating_list, kakuteijyuni_list):
+        assert(len(rating_list) == len(kakuteijyuni_list))
+
+        k_factor_first = 16
+        k_factor_second = 8
+        k_factor_third = 4
+
+        rating = np.array(rating_list, dtype=np.float64)
+        jyuni = np.array(kakuteijyuni_list)
+        match_num = len(rating_list)
+
+        rating_first = RatingCalculator.__rating_at(rating, jyuni, '01')
+        rating_second = RatingCalculator.__rating_at(rating, jyuni, '02')
+        rating_third = RatingCalculator.__rating_at(rating, jyuni, '03')
+
+        if rating_first == 0:
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        # float_power (unlike np.power) goes through libm pow, same as the loop implementation
+        expect = lambda rating_op, rating: 1.0 / (1 + np.float_power(10.0, (rating_op - rating) / 400.0 ))
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        # expect_matrix[i, j]: expectation of horse i against opponent j, ties excluded
+        match_mask = jyuni[:, None] != jyuni[None, :]
+        expect_matrix = np.where(match_mask, expect(rating[None, :], rating[:, None]), 0.0)
+        # accumulate left to right so the sums match the loop implementation bit for bit
+        expect_sum = np.add.accumulate(expect_matrix, axis=1)[:, -1]
+
+        expect_first = expect(rating_first, rating)
+        expect_second = expect(rating_second, rating)
+        expect_third = expect(rating_third, rating)
+
+        new_rating = np.select(
+            [jyuni == '01', jyuni == '02', jyuni == '03'],
+            [rating\
+             + reword(k_factor_first, match_num - 1, expect_sum),
+             rating\
+             + reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, match_num - 2, expect_sum),
+             rating\
+             + reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, 0, expect_second)\
+             + reword(k_factor_third, match_num - 3, expect_sum)],
+            rating\
+            + reword(k_factor_first, 0, expect_first)\
+            + reword(k_factor_second, 0, expect_second)\
+            + reword(k_factor_third, 0, expect_third))
+
+        return new_rating.tolist()
+
 class RecordKeeper:
     def __init__(self, comp_func):
         self.record = 1400
@@ -305,6 +398,63 @@ class RecordKeeper:
         self.changed_ = False
         return c
 
+class ProgressReporter:
+    # the bar is redrawn at most max_rate times per second; without a TTY
+    # a key=value log line is written every log_interval seconds instead
+    max_rate = 4.0
+    log_interval = 10.0
+
+    def __init__(self, total, desc, position=0, file=sys.stdout):
+        self.total = total
+        self.desc = desc
+        self.file = file
+        self.tty = file.isatty()
+        self.interval = 1.0 / self.max_rate if self.tty else self.log_interval
+        self.start = time.monotonic()
+        self.next_time = self.start + self.interval
+        self.done = 0
+        self.pending = 0
+        self.last = None
+        self.bar = tqdm(total=total, desc=desc, position=position, mininterval=self.interval, file=file) if self.tty else None
+
+    def update(self, id, count, record_max, record_min):
+        self.pending += 1
+        self.last = (id, count, record_max, record_min)
+
+        now = time.monotonic()
+        if now < self.next_time:
+            return
+
+        self.next_time = now + self.interval
+        self.__report(id, count, record_max, record_min, now)
+
+    def __report(self, id, count, record_max, record_min, now):
+        self.done += self.pending
+        self.pending = 0
+
+        if self.bar is not None:
+            self.bar.set_postfix_str('id: %s%s%s%s%s%s' % id + ' [%d] max: [%s, %.1lf] min: [%s, %.1lf]'
+                                     % (count, record_max.kettonum, record_max.record, record_min.kettonum, record_min.record), refresh=False)
+            self.bar.update(self.done - self.bar.n)
+            return
+
+        elapsed = now - self.start
+        print('%s progress desc="%s" done=%d total=%d rate=%.1f id=%s%s%s%s%s%s count=%d max=%s:%.1f min=%s:%.1f'
+              % ((datetime.datetime.now().isoformat(timespec='seconds'), self.desc, self.done, self.total, self.done / max(elapsed, 1e-9)) + id
+              + (count, record_max.kettonum, record_max.record, record_min.kettonum, record_min.record)), file=self.file, flush=True)
+
+    def write(self, message):
+        if self.bar is not None:
+            self.bar.write(message, file=self.file)
+        else:
+            print(message, file=self.file)
+
+    def close(self):
+        if self.last is not None:
+            self.__report(*self.last, time.monotonic())
+        if self.bar is not None:
+            self.bar.close()
+
 class RatingUpdator:
     def __init__(self):
         try:
@@ -324,7 +474,13 @@ class RatingUpdator:
         self.connection_processed.close()
 
     def process(self, fromyearmonthday, toyearmonthday):
-        id_list = IDReader.load_data(fromyearmonthday, toyearmonthday, self.connection_raw)
+        race_count = RaceCountReader.load_data(fromyearmonthday, toyearmonthday, self.connection_raw)
+        race_list = RaceReader.load_data(fromyearmonthday, toyearmonthday, self.connection_raw)
+
+        rating_state = RatingState()
+        rating_state.load_data(fromyearmonthday, self.connection_processed)
+        computed_id_set = CurrentRatingReader.load_data(fromyearmonthday, rating_state, self.connection_processed)
+        rating_writer = RatingWriter(self.connection_processed)
 
         new_rating_list = list()
         kettonum_list = list()
@@ -334,32 +490,26 @@ class RatingUpdator:
         record_max = RecordKeeper( lambda x, record_value: x > record_value )
 
         count = 0
-        for id in tqdm(id_list, desc='Gathering race data'):
+        reporter = ProgressReporter(race_count, 'Gathering race data')
+        for id, trackcd, kettonum_list, kakuteijyuni_list in race_list:
+            reporter.update(id, count, record_max, record_min)
 
-            print('\nprocessing id: %s%s%s%s%s%s' % id, ' [%s]' % (count, ))
-            print('max: [%s, %.1lf]' % (record_max.kettonum, record_max.record))
-            print('min: [%s, %.1lf]' % (record_min.kettonum, record_min.record), end='\033[3A\r', flush=True)
-
-            rows = CurrentRatingReader.load_data(id, self.connection_processed)
-            if rows:
-                print('Rating already exists')
+            if id in computed_id_set:
                 continue
 
-            trackcd = TrackcdReader.load_data(id, self.connection_raw)
-
             if not trackcd.isdigit():
-                print("invalid trackcd:", id, trackcd)
+                reporter.write('invalid trackcd: %s %s' % (id, trackcd))
 
             elif trackcd == "00":
-                print("notset:", id,  trackcd)
+                reporter.write('notset: %s %s' % (id, trackcd))
 
             elif int(trackcd) <= 22:
                 try:
-                    kettonum_list, kakuteijyuni_list= UmaReader.load_data(id, self.connection_raw )
-                    rating_list = RatingReader.load_data(id, kettonum_list, self.connection_processed)
+                    rating_list = rating_state.get(kettonum_list)
 
                     new_rating_list = RatingCalculator.estimate(rating_list, kakuteijyuni_list)
-                    RatingWriter.write_data(id, kettonum_list, new_rating_list, self.connection_processed)
+                    rating_writer.write_data(id, kettonum_list, new_rating_list)
+                    rating_state.update(kettonum_list, new_rating_list)
 
                     for rating, kettonum in zip(new_rating_list, kettonum_list):
                         record_min.update(kettonum, rating)
@@ -368,12 +518,16 @@ class RatingUpdator:
                     count = count + 1
 
                 except RuntimeError as e:
-                    print(e)
+                    reporter.write(str(e))
                     continue
 
-        print('\n\n\n\n')
+        rating_writer.flush()
+        reporter.close()
 
 if __name__ == "__main__":
+    if '--vectorized' in sys.argv:
+        RatingCalculator.vectorized = True
+
     updator = RatingUpdator()
     updator.process('19900000', '20200000')
     #updator.process('19990000', '20100000')
@@ -12,3 +12,4 @@ CREATE TABLE uma_rating_20
     PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum)
 );
 
+CREATE INDEX IF NOT EXISTS uma_rating_20_kettonum_idx ON uma_rating_20 (KettoNum, Year, MonthDay);
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import numpy as np
+from tqdm import tqdm
+
+from storage import Storage
+from race_source import DatabaseRaceSource, SelectPhrase
+from race_snapshot import SnapshotRaceSource
+from rating_table import RatingState
+from rating_variant import variant_list
+from prediction import WinProbability, TopThreeProbability
+
+class RaceKey:
+    @classmethod
+    def generate(self, id, kettonum):
+        # sorts like RaceOrder.key within a horse: year, monthday, jyocd, nichiji, racenum, kaiji
+        return id[0] + id[1] + id[2] + id[4] + id[5] + id[3] + kettonum
+
+class RatingHistoryReference:
+    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, kettonum, rating'
+
+    def __init__(self, table):
+        self.table      = table
+        self.cols       = RatingHistoryReference.__cols
+        self.conditions = ''
+        self.order      = 'kettonum ASC, year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC, kaiji ASC'
+        self.limit      = ''
+
+class PreRaceRatingReader:
+    itersize = 50000
+
+    @classmethod
+    def load_data(self, table, connection):
+        # each row is the rating after a race, so the rating before it is the previous row of the same horse
+        key_list = list()
+        kettonum_list = list()
+        rating_list = list()
+
+        with connection.cursor('pre_race_rating_cursor') as cur:
+            cur.itersize = self.itersize
+            cur.execute(SelectPhrase.generate(RatingHistoryReference(table)))
+
+            for row in cur:
+                key_list.append(RaceKey.generate(tuple(row[:6]), row[6]))
+                kettonum_list.append(row[6])
+                rating_list.append(row[7])
+
+        kettonum = np.array(kettonum_list, dtype=str)
+        pre_rating = np.full(len(rating_list), RatingState.initial_rating, dtype=np.float64)
+        same_horse = np.zeros(len(rating_list), dtype=bool)
+        same_horse[1:] = kettonum[1:] == kettonum[:-1]
+        pre_rating[1:][same_horse[1:]] = np.array(rating_list, dtype=np.float64)[:-1][same_horse[1:]]
+
+        key = np.array(key_list, dtype=str)
+        order = np.argsort(key, kind='stable')
+
+        return key[order], pre_rating[order]
+
+class RaceEntryTable:
+    def __init__(self, race_list, race_count):
+        # every starter of every race as flat arrays, races contiguous
+        key_list = list()
+        jyuni_list = list()
+        year_list = list()
+        race_begin_list = list()
+
+        for id, trackcd, kettonum_list, kakuteijyuni_list in tqdm(race_list, total=race_count, desc='Loading race entries', mininterval=1.0):
+            race_begin_list.append(len(key_list))
+            year_list.append(int(id[0]))
+            for kettonum, jyuni in zip(kettonum_list, kakuteijyuni_list):
+                key_list.append(RaceKey.generate(id, kettonum))
+                jyuni_list.append(int(jyuni) if jyuni.isdigit() else 99)
+
+        self.key = np.array(key_list, dtype=str)
+        self.jyuni = np.array(jyuni_list, dtype=np.int64)
+        self.race_year = np.array(year_list, dtype=np.int64)
+        self.race_begin = np.array(race_begin_list, dtype=np.int64)
+        self.race_size = np.diff(np.append(self.race_begin, len(self.key)))
+        self.race_index = np.repeat(np.arange(len(self.race_begin)), self.race_size)
+        self.position = np.arange(len(self.key)) - self.race_begin[self.race_index]
+
+class BacktestScore:
+    epsilon = 1e-15
+    metric_list = ['win log-loss', 'win brier', 'top3 log-loss', 'top3 brier', 'top-1 hit']
+
+    def __init__(self, year_list):
+        self.year_list = year_list
+        self.race_num = np.zeros(len(year_list))
+        self.entry_num = np.zeros(len(year_list))
+        self.total = {metric: np.zeros(len(year_list)) for metric in self.metric_list}
+
+    def update(self, year_index, rating, jyuni, valid):
+        # rating, jyuni, valid: (races, max field size), padding is invalid
+        rating = np.where(valid, rating, -np.inf)
+        win = WinProbability.generate(rating, axis=1)
+        top3 = TopThreeProbability.generate(win)
+
+        is_win = valid & (jyuni == 1)
+        is_top3 = valid & (jyuni <= 3)
+        bounded = lambda p: np.clip(p, self.epsilon, 1 - self.epsilon)
+
+        # ties on the favourite share the hit, so an all-1400 field is not a free point
+        favourite = valid & (win == win.max(axis=1, keepdims=True))
+        hit = (favourite & is_win).any(axis=1) / favourite.sum(axis=1)
+
+        race_metric = {
+            'win log-loss': -np.log(bounded(np.where(is_win, win, 0.0).sum(axis=1))),
+            'win brier': np.where(valid, (win - is_win) ** 2, 0.0).sum(axis=1),
+            'top3 log-loss': -np.where(valid, np.where(is_top3, np.log(bounded(top3)), np.log(bounded(1 - top3))), 0.0).sum(axis=1),
+            'top3 brier': np.where(valid, (top3 - is_top3) ** 2, 0.0).sum(axis=1),
+            'top-1 hit': hit,
+        }
+
+        self.race_num += np.bincount(year_index, minlength=len(self.year_list))
+        self.entry_num += np.bincount(year_index, weights=valid.sum(axis=1), minlength=len(self.year_list))
+        for metric, value in race_metric.items():
+            self.total[metric] += np.bincount(year_index, weights=value, minlength=len(self.year_list))
+
+    def mean(self, metric, index=slice(None)):
+        # log-loss and brier of top-3 are per horse, the rest per race
+        count = self.entry_num if metric.startswith('top3') else self.race_num
+        return np.sum(self.total[metric][index]) / max(np.sum(count[index]), 1)
+
+class Backtest:
+    chunk_size = 2000
+
+    def __init__(self, entry_table):
+        self.entry_table = entry_table
+        self.year_list = np.unique(entry_table.race_year)
+
+    def process(self, pre_key, pre_rating):
+        entry_table = self.entry_table
+
+        found = np.searchsorted(pre_key, entry_table.key)
+        found = np.minimum(found, max(len(pre_key) - 1, 0))
+        matched = (pre_key[found] == entry_table.key) if len(pre_key) else np.zeros(len(entry_table.key), dtype=bool)
+
+        # a race belongs to the variant when all of its starters have a rating row; counted per
+        # race index rather than reduceat on race_begin, which breaks on empty races
+        unmatched_num = np.bincount(entry_table.race_index[~matched], minlength=len(entry_table.race_begin))
+        race_selected = np.flatnonzero((unmatched_num == 0) & (entry_table.race_size > 0))
+
+        score = BacktestScore(self.year_list)
+        max_size = entry_table.race_size.max() if len(entry_table.race_size) else 0
+
+        for chunk_begin in range(0, len(race_selected), self.chunk_size):
+            race_chunk = race_selected[chunk_begin:chunk_begin + self.chunk_size]
+
+            entry = np.concatenate([np.arange(begin, begin + size) for begin, size in zip(entry_table.race_begin[race_chunk], entry_table.race_size[race_chunk])])
+            row = np.repeat(np.arange(len(race_chunk)), entry_table.race_size[race_chunk])
+            column = entry_table.position[entry]
+
+            rating = np.zeros((len(race_chunk), max_size))
+            jyuni = np.full((len(race_chunk), max_size), 99, dtype=np.int64)
+            valid = np.zeros((len(race_chunk), max_size), dtype=bool)
+            rating[row, column] = pre_rating[found[entry]]
+            jyuni[row, column] = entry_table.jyuni[entry]
+            valid[row, column] = True
+
+            year_index = np.searchsorted(self.year_list, entry_table.race_year[race_chunk])
+            score.update(year_index, rating, jyuni, valid)
+
+        return score
+
+if __name__ == "__main__":
+    snapshot = sys.argv[sys.argv.index('--snapshot') + 1] if '--snapshot' in sys.argv else None
+    fromyearmonthday = sys.argv[sys.argv.index('--from') + 1] if '--from' in sys.argv else '19900000'
+    toyearmonthday = sys.argv[sys.argv.index('--to') + 1] if '--to' in sys.argv else '20200000'
+    table_list = [arg for arg in sys.argv[1:] if arg.startswith('uma_rating_')] or [variant.table for variant in variant_list]
+
+    if snapshot:
+        race_source = SnapshotRaceSource(snapshot)
+    else:
+        try:
+            connection_raw  = Storage.connect(os.environ.get('DATABASE_URL_SRC'))
+        except:
+            print('storage: opening connection 01 faied')
+            sys.exit(0)
+        race_source = DatabaseRaceSource(connection_raw)
+
+    try:
+        connection_processed = Storage.connect(os.environ.get('DB_UMA_PROCESSED'))
+    except:
+        print('storage: opening connection 02 faied')
+        sys.exit(0)
+
+    start = time.time()
+    entry_table = RaceEntryTable(race_source.load_data(fromyearmonthday, toyearmonthday), race_source.count(fromyearmonthday, toyearmonthday))
+    backtest = Backtest(entry_table)
+
+    score_dict = dict()
+    for table in table_list:
+        pre_key, pre_rating = PreRaceRatingReader.load_data(table, connection_processed)
+        score_dict[table] = backtest.process(pre_key, pre_rating)
+
+    connection_processed.close()
+
+    header = '%-14s %6s %8s' % ('table', 'year', 'races') + ''.join(' %13s' % metric for metric in BacktestScore.metric_list)
+    print(header)
+    for table, score in score_dict.items():
+        for index, year in enumerate(backtest.year_list):
+            if score.race_num[index]:
+                print('%-14s %6d %8d' % (table, year, score.race_num[index]) + ''.join(' %13.5f' % score.mean(metric, index) for metric in BacktestScore.metric_list))
+        print('%-14s %6s %8d' % (table, 'all', score.race_num.sum()) + ''.join(' %13.5f' % score.mean(metric) for metric in BacktestScore.metric_list))
+    print('%.1f sec' % (time.time() - start))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+
+from synthetic_history import HistoryGenerator, SnapshotHistoryWriter, Option
+from stage_timer import stage_timer
+from rating_variant import variant_list, TopThreeCalculator, TopThreeOtherCalculator
+
+def process_scale(scale, workdir, fromyear, toyear):
+    # imported here so DB_UMA_PROCESSED can point at a fresh database for every scale
+    from rating_calculator import RatingUpdator
+
+    snapshot = os.path.join(workdir, 'synthetic_%gx_%d_%d.npz' % (scale, fromyear, toyear))
+    if not os.path.exists(snapshot):
+        generator = HistoryGenerator(fromyear, toyear, int(36 * scale), 8, 18, 15.0, 0.02, 0)
+        generator.generate(SnapshotHistoryWriter(snapshot))
+
+    processed = os.path.join(workdir, 'synthetic_%gx_rating.db' % scale)
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(processed + suffix):
+            os.remove(processed + suffix)
+    os.environ['DB_UMA_PROCESSED'] = 'sqlite:///' + processed
+
+    stage_timer.reset()
+    start = time.time()
+    updator = RatingUpdator(variant_list, desc='%gx' % scale, snapshot=snapshot)
+    race_num, entry_num = updator.process('%04d0000' % fromyear, '%04d9999' % toyear)
+    del updator
+
+    return scale, race_num, entry_num, time.time() - start
+
+if __name__ == "__main__":
+    if '--vectorized' in sys.argv:
+        TopThreeCalculator.vectorized = True
+        TopThreeOtherCalculator.vectorized = True
+
+    workdir = Option.get('--workdir', '.')
+    fromyear = Option.get('--fromyear', 2019)
+    toyear = Option.get('--toyear', 2019)
+    scale_list = [float(scale) for scale in Option.get('--scales', '1,10,100').split(',')]
+
+    result_list = [process_scale(scale, workdir, fromyear, toyear) for scale in scale_list]
+
+    print()
+    for scale, race_num, entry_num, elapsed in result_list:
+        print('%6gx: %8d races, %9d entries in %8.1f sec (%.1f races/sec)' % (scale, race_num, entry_num, elapsed, race_num / max(elapsed, 1e-9)))
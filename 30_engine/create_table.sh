@@ -0,0 +1 @@
+psql -p 5433 -h localhost -U postgres -d uma_processed -f create_table.sql
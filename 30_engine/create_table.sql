@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS uma_rating_watermark
+(
+    TableName varchar(32),
+    Year char(4),
+    MonthDay char(4),
+    JyoCD char(2),
+    Kaiji char(2),
+    Nichiji char(2),
+    RaceNum char(2),
+    PRIMARY KEY (TableName)
+);
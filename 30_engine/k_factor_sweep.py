@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import itertools
+import numpy as np
+from tqdm import tqdm
+
+from storage import Storage
+from race_source import DatabaseRaceSource
+from race_snapshot import SnapshotRaceSource
+from rating_variant import Surface
+from prediction import WinProbability, ScoreKeeper
+
+class KFactorGrid:
+    # columns: first, second, third, other. other=0 is the 10_shiba_tan scheme,
+    # (16, 12, 8, 4) the 20_shibaonly one, both are part of the default grid
+    first = [8, 16, 24, 32]
+    second = [4, 8, 12]
+    third = [2, 4, 8]
+    other = [0, 4]
+
+    @classmethod
+    def generate(self, first=None, second=None, third=None, other=None):
+        return np.array(list(itertools.product(first or self.first, second or self.second, third or self.third, other or self.other)), dtype=np.float64)
+
+class SweepRatingState:
+    initial_rating = 1400
+    initial_capacity = 65536
+
+    def __init__(self, config_num):
+        self.position = dict()
+        self.rating = np.full((self.initial_capacity, config_num), self.initial_rating, dtype=np.float64)
+
+    def index(self, kettonum_list):
+        for kettonum in kettonum_list:
+            if kettonum not in self.position:
+                self.position[kettonum] = len(self.position)
+
+        if len(self.position) > len(self.rating):
+            grown = np.full((len(self.rating) * 2, self.rating.shape[1]), self.initial_rating, dtype=np.float64)
+            grown[:len(self.rating)] = self.rating
+            self.rating = grown
+
+        return np.array([self.position[kettonum] for kettonum in kettonum_list])
+
+    def get(self, index):
+        return self.rating[index]
+
+    def update(self, index, rating):
+        # same rounding as StoredRating: the SMALLINT of the '%.1f' value, half away from zero
+        rounded = np.round(rating, 1)
+        self.rating[index] = np.where(rounded >= 0, np.floor(rounded + 0.5), -np.floor(-rounded + 0.5))
+
+class SweepCalculator:
+    @classmethod
+    def __rating_at(self, rating, jyuni, target):
+        index = np.flatnonzero(jyuni == target)
+        return rating[index[-1]] if len(index) else np.zeros(rating.shape[1])
+
+    @classmethod
+    def estimate(self, rating, kakuteijyuni_list, k_factor):
+        # TopThreeOtherCalculator with every configuration on the last axis;
+        # rating: (entries, configs), k_factor: (configs, 4)
+        jyuni = np.array(kakuteijyuni_list)
+        match_num = len(kakuteijyuni_list)
+
+        rating_first = SweepCalculator.__rating_at(rating, jyuni, '01')
+        rating_second = SweepCalculator.__rating_at(rating, jyuni, '02')
+        rating_third = SweepCalculator.__rating_at(rating, jyuni, '03')
+
+        if not np.any(jyuni == '01'):
+            raise RuntimeError('invalid data')
+
+        expect = lambda rating_op, rating: 1.0 / (1 + np.float_power(10.0, (rating_op - rating) / 400.0 ))
+
+        match_mask = jyuni[:, None] != jyuni[None, :]
+        expect_matrix = np.where(match_mask[:, :, None], expect(rating[None, :, :], rating[:, None, :]), 0.0)
+        expect_sum = np.add.accumulate(expect_matrix, axis=1)[:, -1]
+
+        expect_first = expect(rating_first[None, :], rating)
+        expect_second = expect(rating_second[None, :], rating)
+        expect_third = expect(rating_third[None, :], rating)
+
+        order = np.array([int(j) for j in kakuteijyuni_list])
+        actual_sum_other = ((order[:, None] < order[None, :]) & match_mask).sum(axis=1)[:, None]
+
+        k_first, k_second, k_third, k_other = k_factor.T
+        is_first, is_second, is_third = [(jyuni == target)[:, None] for target in ['01', '02', '03']]
+
+        return np.select(
+            [is_first, is_second, is_third],
+            [k_first * (match_num - 1 - expect_sum),
+             - k_first * expect_first + k_second * (match_num - 2 - expect_sum),
+             - k_first * expect_first - k_second * expect_second + k_third * (match_num - 3 - expect_sum)],
+            - k_first * expect_first - k_second * expect_second - k_third * expect_third + k_other * (actual_sum_other - expect_sum))
+
+class KFactorSweep:
+    def __init__(self, k_factor, surface, snapshot=None):
+        self.k_factor = k_factor
+        self.surface = surface
+        self.connection_raw = None
+
+        if snapshot:
+            self.race_source = SnapshotRaceSource(snapshot)
+        else:
+            try:
+                self.connection_raw  = Storage.connect(os.environ.get('DATABASE_URL_SRC'))
+            except:
+                print('storage: opening connection 01 faied')
+                sys.exit(0)
+
+            self.race_source = DatabaseRaceSource(self.connection_raw)
+
+    def __del__(self):
+        if self.connection_raw:
+            self.connection_raw.close()
+
+    def process(self, fromyearmonthday, toyearmonthday, scorefromyearmonthday):
+        trackcd_condition = Surface.generate_phrase(self.surface)
+        race_count = self.race_source.count(fromyearmonthday, toyearmonthday, trackcd_condition)
+        race_list = self.race_source.load_data(fromyearmonthday, toyearmonthday, trackcd_condition)
+
+        rating_state = SweepRatingState(len(self.k_factor))
+        score_keeper = ScoreKeeper(len(self.k_factor))
+
+        for id, trackcd, kettonum_list, kakuteijyuni_list in tqdm(race_list, total=race_count, desc='Sweeping %d configurations' % len(self.k_factor), mininterval=1.0):
+            if not self.surface(trackcd):
+                continue
+
+            index = rating_state.index(kettonum_list)
+            rating = rating_state.get(index)
+
+            try:
+                rating_diff = SweepCalculator.estimate(rating, kakuteijyuni_list, self.k_factor)
+            except RuntimeError:
+                continue
+
+            # scored on the pre-race ratings, before this race is folded in
+            if id[0] + id[1] >= scorefromyearmonthday:
+                score_keeper.update(WinProbability.generate(rating), kakuteijyuni_list.index('01'))
+
+            rating_state.update(index, rating + rating_diff)
+
+        return score_keeper
+
+if __name__ == "__main__":
+    surface_name = sys.argv[sys.argv.index('--surface') + 1] if '--surface' in sys.argv else 'shiba'
+    snapshot = sys.argv[sys.argv.index('--snapshot') + 1] if '--snapshot' in sys.argv else None
+    fromyearmonthday = sys.argv[sys.argv.index('--from') + 1] if '--from' in sys.argv else '19900000'
+    toyearmonthday = sys.argv[sys.argv.index('--to') + 1] if '--to' in sys.argv else '20200000'
+    # the first years only warm the ratings up, scoring them would favour large K
+    scorefromyearmonthday = sys.argv[sys.argv.index('--score-from') + 1] if '--score-from' in sys.argv else '%04d0000' % (int(fromyearmonthday[:4]) + 3)
+
+    option = lambda name: [float(k) for k in sys.argv[sys.argv.index(name) + 1].split(',')] if name in sys.argv else None
+    k_factor = KFactorGrid.generate(option('--first'), option('--second'), option('--third'), option('--other'))
+
+    sweep = KFactorSweep(k_factor, getattr(Surface, surface_name), snapshot)
+    score_keeper = sweep.process(fromyearmonthday, toyearmonthday, scorefromyearmonthday)
+
+    print('%d races scored from %s' % (score_keeper.race_num, scorefromyearmonthday))
+    print('%6s %6s %6s %6s %10s %8s' % ('first', 'second', 'third', 'other', 'log-loss', 'top-1'))
+    for index in np.argsort(score_keeper.mean_log_loss()):
+        print('%6g %6g %6g %6g %10.5f %8.4f' % (tuple(k_factor[index]) + (score_keeper.mean_log_loss()[index], score_keeper.hit_rate()[index])))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rating_calculator import RatingUpdator
+from rating_variant import variant_list, Surface, TopThreeCalculator, TopThreeOtherCalculator
+
+class SurfaceGroup:
+    @classmethod
+    def generate(self, variant_list):
+        group_dict = dict()
+        for variant in variant_list:
+            group_dict.setdefault(variant.surface, list()).append(variant.table)
+
+        return group_dict
+
+def process_surface(position, surface_name, table_list, fromyearmonthday, toyearmonthday, vectorized, snapshot):
+    TopThreeCalculator.vectorized = vectorized
+    TopThreeOtherCalculator.vectorized = vectorized
+
+    surface_variant_list = [variant for variant in variant_list if variant.table in table_list]
+    trackcd_condition = Surface.generate_phrase(surface_variant_list[0].surface)
+
+    start = time.time()
+    updator = RatingUpdator(surface_variant_list, trackcd_condition, desc=surface_name, position=position, snapshot=snapshot)
+    race_num, entry_num = updator.process(fromyearmonthday, toyearmonthday)
+    del updator
+
+    return surface_name, race_num, entry_num, time.time() - start
+
+if __name__ == "__main__":
+    vectorized = '--vectorized' in sys.argv
+    snapshot = sys.argv[sys.argv.index('--snapshot') + 1] if '--snapshot' in sys.argv else None
+    table_list = [arg for arg in sys.argv[1:] if arg.startswith('uma_rating_')]
+    unknown_list = [table for table in table_list if table not in [variant.table for variant in variant_list]]
+    if unknown_list:
+        print('parallel_calculator: unknown table %s' % ' '.join(unknown_list))
+        sys.exit(1)
+    group_dict = SurfaceGroup.generate([variant for variant in variant_list if not table_list or variant.table in table_list])
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=len(group_dict)) as executor:
+        future_list = [executor.submit(process_surface, position, surface.__name__, surface_table_list, '19900000', '20200000', vectorized, snapshot)
+                       for position, (surface, surface_table_list) in enumerate(group_dict.items())]
+        result_list = [future.result() for future in future_list]
+    elapsed = time.time() - start
+
+    print('\n\n\n\n')
+    for surface_name, race_num, entry_num, surface_elapsed in result_list:
+        print('%-10s: %6d races, %7d entries in %8.1f sec (%.1f races/sec)' % (surface_name, race_num, entry_num, surface_elapsed, race_num / max(surface_elapsed, 1e-9)))
+
+    race_num = sum(result[1] for result in result_list)
+    entry_num = sum(result[2] for result in result_list)
+    print('%-10s: %6d races, %7d entries in %8.1f sec (%.1f races/sec)' % ('total', race_num, entry_num, elapsed, race_num / max(elapsed, 1e-9)))
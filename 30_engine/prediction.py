@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class WinProbability:
+    @classmethod
+    def generate(self, rating, axis=0):
+        # q_i / sum(q) with q = 10**(r/400): the multi-runner form of the pairwise
+        # expect 1 / (1 + 10**((r_j - r_i) / 400)) used by every calculator.
+        # entries lie on axis, -inf pads a short field and gets probability 0
+        strength = np.float_power(10.0, (rating - rating.max(axis=axis, keepdims=True)) / 400.0)
+        return strength / strength.sum(axis=axis, keepdims=True)
+
+class TopThreeProbability:
+    @classmethod
+    def generate(self, probability):
+        # Harville: finishing orders drawn from the win probabilities without replacement.
+        # probability: (races, entries), padded entries hold 0
+        entry_num = probability.shape[1]
+        other = ~np.eye(entry_num, dtype=bool)
+
+        p_i = probability[:, :, None, None]
+        p_j = probability[:, None, :, None]
+        p_k = probability[:, None, None, :]
+
+        rest_j = 1.0 - probability[:, None, :, None]
+        rest_jk = rest_j - p_k
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            second = np.where(other[None, :, :] & (rest_j[..., 0] > 0), p_j[..., 0] * p_i[..., 0] / rest_j[..., 0], 0.0).sum(axis=2)
+
+            distinct = other[:, :, None] & other[:, None, :] & other[None, :, :]
+            third = np.where(distinct[None] & (rest_j > 0) & (rest_jk > 0), p_j * p_k / rest_j * p_i / rest_jk, 0.0).sum(axis=(2, 3))
+
+        return probability + second + third
+
+class ScoreKeeper:
+    epsilon = 1e-15
+
+    def __init__(self, shape=()):
+        self.race_num = 0
+        self.log_loss = np.zeros(shape)
+        self.hit = np.zeros(shape)
+
+    def update(self, probability, winner):
+        # probability: (entries, ...) from WinProbability, winner: entry index of the '01' horse
+        self.race_num += 1
+        self.log_loss += -np.log(np.maximum(probability[winner], self.epsilon))
+        self.hit += np.argmax(probability, axis=0) == winner
+
+    def mean_log_loss(self):
+        return self.log_loss / max(self.race_num, 1)
+
+    def hit_rate(self):
+        return self.hit / max(self.race_num, 1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import datetime
+from tqdm import tqdm
+
+class ProgressReporter:
+    # the bar is redrawn at most max_rate times per second; without a TTY
+    # a key=value log line is written every log_interval seconds instead
+    max_rate = 4.0
+    log_interval = 10.0
+
+    def __init__(self, total, desc, position=0, file=sys.stdout):
+        self.total = total
+        self.desc = desc
+        self.file = file
+        self.tty = file.isatty()
+        self.interval = 1.0 / self.max_rate if self.tty else self.log_interval
+        self.start = time.monotonic()
+        self.next_time = self.start + self.interval
+        self.done = 0
+        self.pending = 0
+        self.last = None
+        self.bar = tqdm(total=total, desc=desc, position=position, mininterval=self.interval, file=file) if self.tty else None
+
+    def update(self, id, count, variant_list):
+        self.pending += 1
+        self.last = (id, count, variant_list)
+
+        now = time.monotonic()
+        if now < self.next_time:
+            return
+
+        self.next_time = now + self.interval
+        self.__report(id, count, variant_list, now)
+
+    def __report(self, id, count, variant_list, now):
+        self.done += self.pending
+        self.pending = 0
+
+        # the extremes over every variant, folded only when a line is actually written;
+        # with no variant open there are none to show
+        record_postfix = ''
+        record_field = ''
+        if variant_list:
+            record_max = max((variant.record_max for variant in variant_list), key=lambda record: record.record)
+            record_min = min((variant.record_min for variant in variant_list), key=lambda record: record.record)
+            record_postfix = ' max: [%s, %.1lf] min: [%s, %.1lf]' % (record_max.kettonum, record_max.record, record_min.kettonum, record_min.record)
+            record_field = ' max=%s:%.1f min=%s:%.1f' % (record_max.kettonum, record_max.record, record_min.kettonum, record_min.record)
+
+        if self.bar is not None:
+            self.bar.set_postfix_str('id: %s%s%s%s%s%s' % id + ' [%d]' % count + record_postfix, refresh=False)
+            self.bar.update(self.done - self.bar.n)
+            return
+
+        elapsed = now - self.start
+        print('%s progress desc="%s" done=%d total=%d rate=%.1f id=%s%s%s%s%s%s count=%d'
+              % ((datetime.datetime.now().isoformat(timespec='seconds'), self.desc, self.done, self.total, self.done / max(elapsed, 1e-9)) + id
+              + (count,)) + record_field, file=self.file, flush=True)
+
+    def write(self, message):
+        if self.bar is not None:
+            self.bar.write(message, file=self.file)
+        else:
+            print(message, file=self.file)
+
+    def close(self):
+        if self.last is not None:
+            self.__report(*self.last, time.monotonic())
+        if self.bar is not None:
+            self.bar.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class RaceBatch:
+    # many races packed into flat arrays: the entries of race r are entry[begin[r]:begin[r] + size[r]],
+    # and every entry e faces each entry of its own race through pair[pair_begin[e]:pair_begin[e] + size]
+    def __init__(self, rating_list_list, kakuteijyuni_list_list, strength_list_list=None):
+        self.size = np.array([len(rating_list) for rating_list in rating_list_list], dtype=np.int64)
+        self.begin = np.concatenate(([0], np.cumsum(self.size)[:-1])).astype(np.int64)
+        self.race = np.repeat(np.arange(len(self.size)), self.size)
+        self.entry_num = len(self.race)
+
+        self.rating = np.array([rating for rating_list in rating_list_list for rating in rating_list], dtype=np.float64)
+        self.jyuni = np.array([jyuni for kakuteijyuni_list in kakuteijyuni_list_list for jyuni in kakuteijyuni_list], dtype=str)
+        if strength_list_list is None:
+            self.strength = None
+        else:
+            self.strength = np.array([strength for strength_list in strength_list_list for strength in strength_list], dtype=np.float64)
+
+        self.match_num = self.size[self.race]
+        self.pair_begin = np.concatenate(([0], np.cumsum(self.match_num)[:-1])).astype(np.int64)
+        self.left = np.repeat(np.arange(self.entry_num), self.match_num)
+        self.right = self.begin[self.race[self.left]] + np.arange(len(self.left)) - self.pair_begin[self.left]
+
+    def operand(self):
+        return self.rating if self.strength is None else self.strength
+
+    def missing_operand(self):
+        # a missing 2nd/3rd place counts as rating 0, whose q is 1
+        return 0.0 if self.strength is None else 1.0
+
+    def expect(self, operand_op, operand):
+        if self.strength is None:
+            # float_power (unlike np.power) goes through libm pow, same as the loop implementation
+            return 1.0 / (1 + np.float_power(10.0, (operand_op - operand) / 400.0 ))
+        return operand / (operand + operand_op)
+
+    def expect_pairs(self):
+        # expectation of the left entry of every pair against the right one
+        operand = self.operand()
+        return self.expect(operand[self.right], operand[self.left])
+
+    def sum_pairs(self, pair_value):
+        # opponent by opponent, left to right like the loop implementation; np.add.reduceat
+        # switches to pairwise summation for segments over 8 and would not be bit identical
+        total = np.zeros(self.entry_num)
+        for column in range(self.size.max() if len(self.size) else 0):
+            entry = np.flatnonzero(self.match_num > column)
+            total[entry] += pair_value[self.pair_begin[entry] + column]
+        return total
+
+    def count_pairs(self, pair_flag):
+        # integer counts are exact in any order
+        if not len(pair_flag):
+            return np.zeros(self.entry_num, dtype=np.int64)
+        return np.add.reduceat(pair_flag.astype(np.int64), self.pair_begin)
+
+    def place(self, value, target, default=0.0):
+        # value of the last entry finishing at target in each race, broadcast to the entries of that race
+        flagged = np.where(self.jyuni == target, np.arange(self.entry_num), -1)
+        last = np.maximum.reduceat(flagged, self.begin) if self.entry_num else flagged
+        return np.where(last >= 0, value[np.maximum(last, 0)], default)[self.race]
+
+    def split(self, value):
+        return [value[begin:begin + size].tolist() for begin, size in zip(self.begin.tolist(), self.size.tolist())]
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import itertools
+
+class RaceScheduler:
+    @classmethod
+    def generate_day(self, race_list):
+        # the stream is ordered by date first, so a day is a run of equal (year, monthday)
+        for yearmonthday, day_race_list in itertools.groupby(race_list, key=lambda race: race[0][:2]):
+            yield list(day_race_list)
+
+    @classmethod
+    def generate_level(self, day_race_list):
+        # a race depends on the previous race of each of its horses; level n only needs
+        # levels < n, and races of one level share no horse with each other
+        level_list = list()
+        horse_level = dict()
+
+        for race in day_race_list:
+            kettonum_list = race[2]
+            level = max((horse_level.get(kettonum, -1) for kettonum in kettonum_list), default=-1) + 1
+            for kettonum in kettonum_list:
+                horse_level[kettonum] = level
+
+            if level == len(level_list):
+                level_list.append(list())
+            level_list[level].append(race)
+
+        return level_list
+
+class DayRunner:
+    # the races of a level share no horse, so each variant computes a level as one batch
+    def __init__(self, variant_list):
+        self.variant_list = variant_list
+
+    def __compute_level(self, level_race_list):
+        return zip(*[variant.compute_level(level_race_list) for variant in self.variant_list])
+
+    def process(self, day_race_list):
+        # compute a level, then commit it in stream order before the next level reads the state
+        for level_race_list in RaceScheduler.generate_level(day_race_list):
+            for race, result_list in zip(level_race_list, self.__compute_level(level_race_list)):
+                for variant, result in zip(self.variant_list, result_list):
+                    variant.commit(race[0], race[2], result)
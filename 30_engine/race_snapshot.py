@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os
+import sys
+from tqdm import tqdm
+
+from storage import Storage
+from race_source import DateFilter, SelectPhrase, TrackcdRange
+
+class SnapshotReference:
+    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, trackcd, datakubun, kettonum, ijyocd, kakuteijyuni'
+
+    def __init__(self, fromyearmonthday, toyearmonthday):
+        self.table      = 'n_race JOIN n_uma_race USING (year, monthday, jyocd, kaiji, nichiji, racenum)'
+        self.cols       = 'year, monthday, jyocd, kaiji, nichiji, racenum, trackcd, n_race.datakubun, kettonum, ijyocd, kakuteijyuni'
+        self.conditions = "n_uma_race.datakubun='7'" + ' AND' + DateFilter.generate_condition_older(fromyearmonthday) + ' AND' + DateFilter.generate_condition_newer(toyearmonthday)
+        self.order      = 'year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC, kaiji ASC, kettonum DESC'
+        self.limit      = ''
+
+    @classmethod
+    def colnames(self):
+        return self.__cols.strip().split(', ')
+
+class SnapshotWriter:
+    itersize = 50000
+
+    @classmethod
+    def write_data(self, path, fromyearmonthday, toyearmonthday, connection):
+        column_list = [list() for colname in SnapshotReference.colnames()]
+
+        with connection.cursor('snapshot_cursor') as cur:
+            cur.itersize = self.itersize
+            query = SelectPhrase.generate(SnapshotReference(fromyearmonthday, toyearmonthday))
+            cur.execute(query)
+
+            for row in tqdm(cur, desc='Exporting race entries'):
+                for column, value in zip(column_list, row):
+                    column.append(value if value is not None else '')
+
+        np.savez_compressed(path, **{colname: np.array(column, dtype=str) for colname, column in zip(SnapshotReference.colnames(), column_list)})
+
+        return len(column_list[0])
+
+class SnapshotRaceSource:
+    __id_cols = ['year', 'monthday', 'jyocd', 'kaiji', 'nichiji', 'racenum']
+
+    def __init__(self, path):
+        with np.load(path) as snapshot:
+            self.column_dict = {colname: snapshot[colname] for colname in SnapshotReference.colnames()}
+
+        entry_num = len(self.column_dict['kettonum'])
+        boundary = np.zeros(entry_num, dtype=bool)
+        boundary[:1] = True
+        for colname in self.__id_cols:
+            column = self.column_dict[colname]
+            boundary[1:] |= column[1:] != column[:-1]
+
+        self.race_begin = np.flatnonzero(boundary)
+        self.race_end = np.append(self.race_begin[1:], entry_num)
+        self.race_yearmonthday = np.char.add(self.column_dict['year'][self.race_begin], self.column_dict['monthday'][self.race_begin])
+
+    def __select(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        valid = (self.column_dict['datakubun'][self.race_begin] == '7')\
+              & (self.race_yearmonthday >= fromyearmonthday)\
+              & (self.race_yearmonthday <= toyearmonthday)
+
+        # same rows as the BETWEEN of the SQL stream, compared as strings like the database does
+        if trackcd_condition:
+            if not isinstance(trackcd_condition, TrackcdRange):
+                raise ValueError('snapshot: unsupported trackcd condition%s' % trackcd_condition)
+            trackcd = self.column_dict['trackcd'][self.race_begin]
+            valid &= (trackcd >= trackcd_condition.low) & (trackcd <= trackcd_condition.high)
+
+        return self.race_begin[valid], self.race_end[valid]
+
+    def count(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        race_begin, race_end = self.__select(fromyearmonthday, toyearmonthday, trackcd_condition)
+        return len(race_begin)
+
+    def kettonum_list(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        race_begin, race_end = self.__select(fromyearmonthday, toyearmonthday, trackcd_condition)
+        if not len(race_begin):
+            return []
+        kettonum = self.column_dict['kettonum']
+        return np.unique(np.concatenate([kettonum[begin:end] for begin, end in zip(race_begin.tolist(), race_end.tolist())])).tolist()
+
+    def load_data(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        id_column_list = [self.column_dict[colname] for colname in self.__id_cols]
+        trackcd = self.column_dict['trackcd']
+        kettonum = self.column_dict['kettonum']
+        ijyocd = self.column_dict['ijyocd']
+        kakuteijyuni = self.column_dict['kakuteijyuni']
+
+        race_begin, race_end = self.__select(fromyearmonthday, toyearmonthday, trackcd_condition)
+        for begin, end in zip(race_begin.tolist(), race_end.tolist()):
+            id = tuple(column[begin].item() for column in id_column_list)
+            starter = ijyocd[begin:end] == '0'
+
+            yield id, trackcd[begin].item(), kettonum[begin:end][starter].tolist(), kakuteijyuni[begin:end][starter].tolist()
+
+if __name__ == "__main__":
+    if (len(sys.argv) != 2 and len(sys.argv) != 4):
+        print('usage: race_snapshot.py <snapshot.npz> [<from yyyymmdd> <to yyyymmdd>]')
+        sys.exit(0)
+
+    fromyearmonthday, toyearmonthday = (sys.argv[2], sys.argv[3]) if len(sys.argv) == 4 else ('19900000', '20200000')
+
+    try:
+        connection_raw  = Storage.connect(os.environ.get('DATABASE_URL_SRC'))
+    except:
+        print('storage: opening connection 01 faied')
+        sys.exit(0)
+
+    entry_num = SnapshotWriter.write_data(sys.argv[1], fromyearmonthday, toyearmonthday, connection_raw)
+    print('%d entries written to %s' % (entry_num, sys.argv[1]))
+
+    connection_raw.close()
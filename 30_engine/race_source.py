@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import itertools
+
+class IDFilter:
+    @classmethod
+    def generate_phrase(cls, id):
+        return " year='%s' AND monthday='%s' AND jyocd='%s' AND kaiji='%s' AND nichiji='%s' AND racenum='%s'" % id
+
+class IDFilterUntilToday:
+    @classmethod
+    def generate_phrase(cls, id):
+        return " (year, monthday)<('%s', '%s')" % (id[0], id[1])
+
+class DateFilter:
+    @classmethod
+    def generate_condition_older(cls, yearmonthday):
+        return " (year, monthday)>=('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
+
+    @classmethod
+    def generate_condition_newer(cls, yearmonthday):
+        return " (year, monthday)<=('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
+
+class KettonumFilter:
+    @classmethod
+    def generate_phrase(cls, kettonum_list):
+        return " kettonum IN (%s)" % ', '.join("'%s'" % kettonum for kettonum in kettonum_list)
+
+class TrackcdRange(str):
+    # the SQL phrase itself, with its bounds kept for sources that filter without SQL
+    def __new__(cls, low, high):
+        phrase = str.__new__(cls, " trackcd BETWEEN '%s' AND '%s'" % (low, high))
+        phrase.low = low
+        phrase.high = high
+        return phrase
+
+    def __getnewargs__(self):
+        return (self.low, self.high)
+
+class RaceOrder:
+    @classmethod
+    def key(cls, id):
+        # same order as RaceEntryReference: year, monthday, jyocd, nichiji, racenum, kaiji
+        return (id[0], id[1], id[2], id[4], id[5], id[3])
+
+class SelectPhrase:
+    @classmethod
+    def generate(self, reference):
+        query = 'SELECT ' + reference.cols.strip() + ' FROM ' + reference.table.strip()
+
+        if reference.conditions.strip():
+            query += ' WHERE ' + reference.conditions.strip()
+
+        if reference.order.strip():
+            query += ' ORDER BY ' + reference.order.strip()
+
+        if reference.limit.strip():
+            query += ' LIMIT ' + reference.limit.strip()
+
+        return query
+
+class IDListReference:
+    def __init__(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        self.table      = 'n_race'
+        self.cols       = 'year, monthday, jyocd, kaiji, nichiji, racenum'
+        self.conditions = "datakubun='7'" + ' AND' + DateFilter.generate_condition_older(fromyearmonthday) + ' AND' + DateFilter.generate_condition_newer(toyearmonthday)
+        if trackcd_condition:
+            self.conditions += ' AND' + trackcd_condition
+        self.order      = 'year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC'
+        self.limit      = ''
+
+class RaceEntryReference:
+    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, trackcd, kettonum, ijyocd, kakuteijyuni'
+
+    def __init__(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        self.table      = 'n_race JOIN n_uma_race USING (year, monthday, jyocd, kaiji, nichiji, racenum)'
+        self.cols       = RaceEntryReference.__cols
+        self.conditions = "n_race.datakubun='7' AND n_uma_race.datakubun='7'" + ' AND' + DateFilter.generate_condition_older(fromyearmonthday) + ' AND' + DateFilter.generate_condition_newer(toyearmonthday)
+        if trackcd_condition:
+            self.conditions += ' AND' + trackcd_condition
+        self.order      = 'year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC, kaiji ASC, kettonum DESC'
+        self.limit      = ''
+
+    @classmethod
+    def index(self, colname):
+        return self.__cols.strip().split(', ').index(colname)
+
+class RaceCountReader:
+    @classmethod
+    def load_data(self, fromyearmonthday, toyearmonthday, connection, trackcd_condition=''):
+        reference = IDListReference(fromyearmonthday, toyearmonthday, trackcd_condition)
+        reference.cols  = 'count(*)'
+        reference.order = ''
+
+        with connection.cursor() as cur:
+            cur.execute(SelectPhrase.generate(reference))
+            row = cur.fetchone()
+
+        return row[0]
+
+class KettonumReader:
+    @classmethod
+    def load_data(self, fromyearmonthday, toyearmonthday, connection, trackcd_condition=''):
+        # every horse entered in the races of the period
+        reference = RaceEntryReference(fromyearmonthday, toyearmonthday, trackcd_condition)
+        reference.cols  = 'DISTINCT kettonum'
+        reference.order = ''
+
+        with connection.cursor() as cur:
+            cur.execute(SelectPhrase.generate(reference))
+            rows = cur.fetchall()
+
+        return [row[0] for row in rows]
+
+class RaceReader:
+    itersize = 50000
+
+    @classmethod
+    def __analyze(self, rows):
+        kakuteijyuni_list = list()
+        kettonum_list = list()
+
+        for row in rows:
+            if row[RaceEntryReference.index('ijyocd')] != '0':
+                continue
+            kettonum_list.append( row[RaceEntryReference.index('kettonum')] )
+            kakuteijyuni_list.append( row[RaceEntryReference.index('kakuteijyuni')] )
+
+        return kettonum_list, kakuteijyuni_list
+
+    @classmethod
+    def load_data(self, fromyearmonthday, toyearmonthday, connection, trackcd_condition=''):
+        with connection.cursor('race_cursor') as cur:
+            cur.itersize = self.itersize
+            query = SelectPhrase.generate(RaceEntryReference(fromyearmonthday, toyearmonthday, trackcd_condition))
+            cur.execute(query)
+
+            for id, rows in itertools.groupby(cur, key=lambda row: tuple(row[:6])):
+                rows = list(rows)
+                trackcd = rows[0][RaceEntryReference.index('trackcd')]
+                kettonum_list, kakuteijyuni_list = RaceReader.__analyze(rows)
+
+                yield id, trackcd, kettonum_list, kakuteijyuni_list
+
+class DatabaseRaceSource:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def count(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        return RaceCountReader.load_data(fromyearmonthday, toyearmonthday, self.connection, trackcd_condition)
+
+    def kettonum_list(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        return KettonumReader.load_data(fromyearmonthday, toyearmonthday, self.connection, trackcd_condition)
+
+    def load_data(self, fromyearmonthday, toyearmonthday, trackcd_condition=''):
+        return RaceReader.load_data(fromyearmonthday, toyearmonthday, self.connection, trackcd_condition)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import os
+import datetime
+import sys
+
+from storage import Storage
+from race_source import DatabaseRaceSource
+from race_snapshot import SnapshotRaceSource
+from rating_table import RatingEraser, WatermarkReader
+from rating_checkpoint import CheckpointPath, CheckpointReader, RatingSnapshotDirectory, SnapshotPeriod
+from stage_timer import stage_timer
+from progress_reporter import ProgressReporter
+from race_scheduler import RaceScheduler, DayRunner
+from weight_matrix import WeightMatrixRegistry
+from rating_variant import variant_list, RatingVariant, TopThreeCalculator, TopThreeOtherCalculator
+
+class RatingUpdator:
+    def __init__(self, variant_list, trackcd_condition='', desc='Gathering race data', position=0, snapshot=None, timing_json=None,
+                 checkpoint_dir=None, checkpoint_interval=5000, rating_snapshot_dir=None, rating_snapshot_interval='month'):
+        self.variant_list = variant_list
+        self.timing_json = timing_json
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_race_num = 0
+        self.rating_snapshot_dir = rating_snapshot_dir
+        self.rating_snapshot_interval = rating_snapshot_interval
+        self.rating_snapshot_boundary = None
+        self.trackcd_condition = trackcd_condition
+        self.desc = desc
+        self.position = position
+        self.connection_raw = None
+
+        if snapshot:
+            self.race_source = SnapshotRaceSource(snapshot)
+        else:
+            try:
+                self.connection_raw  = Storage.connect(os.environ.get('DATABASE_URL_SRC'))
+            except:
+                print('storage: opening connection 01 faied')
+                sys.exit(0)
+
+            self.race_source = DatabaseRaceSource(self.connection_raw)
+
+        try:
+            self.connection_processed = Storage.connect(os.environ.get('DB_UMA_PROCESSED'))
+        except:
+            print('storage: opening connection 02 faied')
+            sys.exit(0)
+
+    def __del__(self):
+        if self.connection_raw:
+            self.connection_raw .close()
+        self.connection_processed.close()
+
+    def __checkpoint(self, race_num, force=False):
+        # only between races, after every variant committed the same prefix of the stream
+        if not self.checkpoint_dir:
+            return
+
+        if force or race_num - self.checkpoint_race_num >= self.checkpoint_interval:
+            for variant in self.variant_list:
+                variant.checkpoint(CheckpointPath.generate(self.checkpoint_dir, variant.table))
+            self.checkpoint_race_num = race_num
+
+    def __rating_snapshot(self, id):
+        # called before the first race of each day, so the state holds exactly the races before it;
+        # a variant that already holds later races (watermark, computed rows) has nothing valid to save
+        if not self.rating_snapshot_dir:
+            return
+
+        boundary = SnapshotPeriod.generate(id[0] + id[1], self.rating_snapshot_interval)
+        if self.rating_snapshot_boundary is not None and boundary > self.rating_snapshot_boundary:
+            for variant in self.variant_list:
+                if variant.loaded_until < boundary:
+                    variant.checkpoint(RatingSnapshotDirectory(self.rating_snapshot_dir, variant.table).path(boundary))
+        self.rating_snapshot_boundary = boundary
+
+    def process(self, fromyearmonthday, toyearmonthday, checkpoint_list=None, kettonum_list=None):
+        with stage_timer.measure('race_source.count'):
+            race_count = self.race_source.count(fromyearmonthday, toyearmonthday, self.trackcd_condition)
+        race_list = stage_timer.iterate('race_source.read', self.race_source.load_data(fromyearmonthday, toyearmonthday, self.trackcd_condition),
+                                        row_count=lambda race: len(race[2]))
+
+        for variant, checkpoint in zip(self.variant_list, checkpoint_list or [None] * len(self.variant_list)):
+            variant.open(fromyearmonthday, self.connection_processed, checkpoint, kettonum_list)
+
+        race_num = 0
+        entry_num = 0
+        reporter = ProgressReporter(race_count, self.desc, self.position)
+        if RatingVariant.batch:
+            day_runner = DayRunner(self.variant_list)
+            for day_race_list in RaceScheduler.generate_day(race_list):
+                self.__rating_snapshot(day_race_list[0][0])
+                day_runner.process(day_race_list)
+
+                for id, trackcd, kettonum_list, kakuteijyuni_list in day_race_list:
+                    race_num = race_num + 1
+                    entry_num = entry_num + len(kettonum_list)
+                    reporter.update(id, race_num, self.variant_list)
+                self.__checkpoint(race_num)
+        else:
+            for id, trackcd, kettonum_list, kakuteijyuni_list in race_list:
+                self.__rating_snapshot(id)
+                for variant in self.variant_list:
+                    variant.update(id, trackcd, kettonum_list, kakuteijyuni_list)
+
+                race_num = race_num + 1
+                entry_num = entry_num + len(kettonum_list)
+
+                reporter.update(id, race_num, self.variant_list)
+                self.__checkpoint(race_num)
+
+        for variant in self.variant_list:
+            variant.close()
+        self.__checkpoint(race_num, force=True)
+        reporter.close()
+
+        for variant in self.variant_list:
+            print('%s: %d races, max: [%s, %.1lf], min: [%s, %.1lf]' % (variant.table, variant.count,
+                  variant.record_max.kettonum, variant.record_max.record, variant.record_min.kettonum, variant.record_min.record))
+
+        stage_timer.report(self.timing_json)
+
+        return race_num, entry_num
+
+    def process_incremental(self):
+        fromyearmonthday = '19900000'
+        toyearmonthday = datetime.date.today().strftime('%Y%m%d')
+        watermark_list = [WatermarkReader.load_data(variant.table, self.connection_processed) for variant in self.variant_list]
+        kettonum_list = None
+
+        if all(watermark_list):
+            fromyearmonthday = min(watermark[0] + watermark[1] for watermark in watermark_list)
+            # only the horses that run from here on are ever read, so only they are seeded;
+            # checkpoints and rating snapshots store the whole state and still need every horse
+            if not self.checkpoint_dir and not self.rating_snapshot_dir:
+                with stage_timer.measure('race_source.kettonum'):
+                    kettonum_list = self.race_source.kettonum_list(fromyearmonthday, toyearmonthday, self.trackcd_condition)
+
+        for variant, watermark in zip(self.variant_list, watermark_list):
+            variant.watermark = watermark
+
+        self.process(fromyearmonthday, toyearmonthday, kettonum_list=kettonum_list)
+
+    def process_checkpoint(self):
+        # state straight from the memory-mapped checkpoints, only races after their watermark are read
+        fromyearmonthday = '19900000'
+        checkpoint_list = [CheckpointReader.load_data(CheckpointPath.generate(self.checkpoint_dir, variant.table)) for variant in self.variant_list]
+        watermark_list = [checkpoint[0] if checkpoint else None for checkpoint in checkpoint_list]
+
+        if all(watermark_list):
+            fromyearmonthday = min(watermark[0] + watermark[1] for watermark in watermark_list)
+
+        for variant, watermark in zip(self.variant_list, watermark_list):
+            variant.watermark = watermark
+
+        # rows from the start day on are folded over the checkpoint as usual, and the table holds
+        # every race up to the watermark, so the latest row of each horse is still the one that wins
+        self.process(fromyearmonthday, datetime.date.today().strftime('%Y%m%d'), checkpoint_list)
+
+    def process_rebuild(self, rebuildyearmonthday):
+        # start from the nearest rating snapshot at or before the date and replay only the tail;
+        # rows and snapshots after the snapshot are stale once the calculation changed, so they go first
+        checkpoint_list = list()
+        boundary_list = list()
+
+        for variant in self.variant_list:
+            rating_snapshot_directory = RatingSnapshotDirectory(self.rating_snapshot_dir, variant.table)
+            boundary = rating_snapshot_directory.nearest(rebuildyearmonthday)
+            checkpoint_list.append(CheckpointReader.load_data(rating_snapshot_directory.path(boundary)) if boundary else None)
+            boundary_list.append(boundary or '19900000')
+
+            RatingEraser.write_data(variant.table, boundary or '19900000', self.connection_processed)
+            rating_snapshot_directory.discard_after(boundary or '19900000')
+            variant.watermark = None
+
+        # a variant whose snapshot is later than the start folds its remaining rows back in at open,
+        # which lands on the same state as its snapshot
+        self.process(min(boundary_list), datetime.date.today().strftime('%Y%m%d'), checkpoint_list)
+
+if __name__ == "__main__":
+    if '--vectorized' in sys.argv:
+        TopThreeCalculator.vectorized = True
+        TopThreeOtherCalculator.vectorized = True
+
+    if '--as-of-index' in sys.argv:
+        RatingVariant.as_of_index = True
+
+    if '--cached-strength' in sys.argv:
+        RatingVariant.cached_strength = True
+
+    if '--batch' in sys.argv:
+        RatingVariant.batch = True
+
+    if '--weight-matrix' in sys.argv:
+        for variant in variant_list:
+            variant.calculator = WeightMatrixRegistry.generate(variant.table)
+
+    snapshot = sys.argv[sys.argv.index('--snapshot') + 1] if '--snapshot' in sys.argv else None
+    timing_json = sys.argv[sys.argv.index('--timing-json') + 1] if '--timing-json' in sys.argv else None
+    checkpoint_dir = sys.argv[sys.argv.index('--checkpoint') + 1] if '--checkpoint' in sys.argv else None
+    checkpoint_interval = int(sys.argv[sys.argv.index('--checkpoint-interval') + 1]) if '--checkpoint-interval' in sys.argv else 5000
+    rating_snapshot_dir = sys.argv[sys.argv.index('--rating-snapshot') + 1] if '--rating-snapshot' in sys.argv else None
+    rating_snapshot_interval = sys.argv[sys.argv.index('--rating-snapshot-interval') + 1] if '--rating-snapshot-interval' in sys.argv else 'month'
+    table_list = [arg for arg in sys.argv[1:] if arg.startswith('uma_rating_')]
+    unknown_list = [table for table in table_list if table not in [variant.table for variant in variant_list]]
+    if unknown_list:
+        print('rating_calculator: unknown table %s' % ' '.join(unknown_list))
+        sys.exit(1)
+    stage_timer.install(timing_json)
+    updator = RatingUpdator([variant for variant in variant_list if not table_list or variant.table in table_list], snapshot=snapshot, timing_json=timing_json,
+                           checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                           rating_snapshot_dir=rating_snapshot_dir, rating_snapshot_interval=rating_snapshot_interval)
+
+    if '--rebuild-from' in sys.argv and rating_snapshot_dir:
+        updator.process_rebuild(sys.argv[sys.argv.index('--rebuild-from') + 1])
+    elif '--resume' in sys.argv and checkpoint_dir:
+        updator.process_checkpoint()
+    elif '--incremental' in sys.argv:
+        updator.process_incremental()
+    else:
+        updator.process('19900000', '20200000')
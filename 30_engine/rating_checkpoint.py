@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+
+class CheckpointPath:
+    @classmethod
+    def generate(self, checkpoint_dir, table):
+        return os.path.join(checkpoint_dir, '%s.ckpt' % table)
+
+class SnapshotPeriod:
+    @classmethod
+    def generate(self, yearmonthday, interval='month'):
+        # first day of the period holding yearmonthday
+        if interval == 'year':
+            return yearmonthday[:4] + '0101'
+        return yearmonthday[:6] + '01'
+
+class RatingSnapshotDirectory:
+    # <snapshot_dir>/<table>/<yyyymmdd>.ckpt: the state of every race before yyyymmdd
+    def __init__(self, snapshot_dir, table):
+        self.directory = os.path.join(snapshot_dir, table)
+
+    def path(self, yearmonthday):
+        return os.path.join(self.directory, '%s.ckpt' % yearmonthday)
+
+    def boundary_list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len('.ckpt')] for name in os.listdir(self.directory) if name.endswith('.ckpt'))
+
+    def nearest(self, yearmonthday):
+        boundary_list = [boundary for boundary in self.boundary_list() if boundary <= yearmonthday]
+        return boundary_list[-1] if boundary_list else None
+
+    def discard_after(self, yearmonthday):
+        for boundary in self.boundary_list():
+            if boundary > yearmonthday:
+                os.remove(self.path(boundary))
+
+class CheckpointWriter:
+    # one file of consecutive .npy records: watermark, kettonum (sorted), rating, last race key.
+    # written next to the old checkpoint and renamed over it, so a crash leaves one or the other
+    @classmethod
+    def write_data(self, path, watermark, kettonum_list, rating_list, race_key_list):
+        array_list = [
+            np.array(watermark or (), dtype='U4'),
+            np.array(kettonum_list, dtype='U10'),
+            np.array(rating_list, dtype=np.int32),
+            np.array(race_key_list, dtype='U16'),
+        ]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temporary_path = '%s.tmp-%d' % (path, os.getpid())
+        with open(temporary_path, 'wb') as f:
+            for array in array_list:
+                np.lib.format.write_array(f, array, allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary_path, path)
+
+        # the rename itself is only durable once the directory entry is
+        directory_fd = os.open(directory or '.', os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+class CheckpointReader:
+    @classmethod
+    def load_data(self, path):
+        # the arrays are memory-mapped in place, nothing is read until it is touched
+        if not os.path.exists(path):
+            return None
+
+        array_list = list()
+        with open(path, 'rb') as f:
+            for _ in range(4):
+                version = np.lib.format.read_magic(f)
+                read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+                shape, fortran_order, dtype = read_header(f)
+                offset = f.tell()
+                count = int(np.prod(shape))
+                if count:
+                    array_list.append(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape))
+                else:
+                    array_list.append(np.zeros(shape, dtype=dtype))
+                f.seek(offset + count * dtype.itemsize)
+
+        watermark, kettonum, rating, race_key = array_list
+        return tuple(watermark.tolist()) or None, kettonum, rating, race_key
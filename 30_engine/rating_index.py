@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import bisect
+import numpy as np
+
+from race_source import IDFilterUntilToday, SelectPhrase
+
+class RatingHistoryReference:
+    __cols = 'kettonum, year, monthday, rating'
+
+    def __init__(self, table, toyearmonthday=None):
+        self.table      = table
+        self.cols       = RatingHistoryReference.__cols
+        self.conditions = IDFilterUntilToday.generate_phrase((toyearmonthday[:4], toyearmonthday[4:])) if toyearmonthday else ''
+        self.order      = 'kettonum ASC, year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC, kaiji ASC'
+        self.limit      = ''
+
+    @classmethod
+    def index(self, colname):
+        return self.__cols.strip().split(', ').index(colname)
+
+class AsOfRatingIndex:
+    # one horse's history is a contiguous, date sorted slice of date_list/rating_list;
+    # "as of X" means the last rating written by a race strictly before X, like LatestRatingReference
+    __date_scale = 100000000
+
+    def __init__(self, kettonum_list, yearmonthday_list, rating_list):
+        kettonum = np.array(kettonum_list, dtype=str)
+        date = np.array(yearmonthday_list, dtype=np.int64)
+
+        boundary = np.ones(len(kettonum), dtype=bool)
+        boundary[1:] = kettonum[1:] != kettonum[:-1]
+        horse = np.cumsum(boundary) - 1
+
+        self.kettonum_array = kettonum[boundary]
+        self.begin = np.flatnonzero(boundary)
+        self.end = np.append(self.begin[1:], len(kettonum))
+        self.position = {kettonum: index for index, kettonum in enumerate(self.kettonum_array.tolist())}
+
+        self.date_list = date.tolist()
+        self.rating_list = list(rating_list)
+        self.rating_array = np.array(rating_list)
+        self.begin_list = self.begin.tolist()
+        self.end_list = self.end.tolist()
+
+        # (horse, date) packed into one sorted key so every horse is searched in a single call
+        self.key = horse.astype(np.int64) * self.__date_scale + date
+
+    def __len__(self):
+        return len(self.kettonum_array)
+
+    def get(self, kettonum, yearmonthday, default=None):
+        index = self.position.get(kettonum)
+        if index is None:
+            return default
+
+        begin = self.begin_list[index]
+        found = bisect.bisect_left(self.date_list, int(yearmonthday), begin, self.end_list[index])
+        return self.rating_list[found - 1] if found > begin else default
+
+    def get_all(self, yearmonthday, kettonum_list=None):
+        if kettonum_list is None:
+            horse = np.arange(len(self.kettonum_array), dtype=np.int64)
+        else:
+            horse = np.array([self.position.get(kettonum, -1) for kettonum in kettonum_list], dtype=np.int64)
+            horse = horse[horse >= 0]
+
+        found = np.searchsorted(self.key, horse * self.__date_scale + int(yearmonthday), side='left')
+        rated = found > self.begin[horse]
+
+        return self.kettonum_array[horse[rated]], self.rating_array[found[rated] - 1]
+
+class RatingIndexReader:
+    itersize = 50000
+
+    @classmethod
+    def load_data(self, table, connection, toyearmonthday=None):
+        kettonum_list = list()
+        yearmonthday_list = list()
+        rating_list = list()
+
+        with connection.cursor('rating_index_cursor') as cur:
+            cur.itersize = self.itersize
+            cur.execute(SelectPhrase.generate(RatingHistoryReference(table, toyearmonthday)))
+
+            for kettonum, year, monthday, rating in cur:
+                kettonum_list.append(kettonum)
+                yearmonthday_list.append(year + monthday)
+                rating_list.append(rating)
+
+        return AsOfRatingIndex(kettonum_list, yearmonthday_list, rating_list)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import io
+import numpy as np
+
+from race_source import DateFilter, IDFilterUntilToday, KettonumFilter, RaceOrder, SelectPhrase
+
+watermark_table = 'uma_rating_watermark'
+
+class StoredRating:
+    @classmethod
+    def generate(self, rating):
+        # same value the SMALLINT column would hold after an INSERT of '%.1f'
+        rounded = float('%.1f' % rating)
+        return int(rounded + 0.5) if rounded >= 0 else -int(-rounded + 0.5)
+
+class CopyPhrase:
+    @classmethod
+    def generate(self, id, kettonum, rating, diff=None):
+        values = id + (kettonum, '%d' % StoredRating.generate(rating))
+        if diff is not None:
+            values += ('%d' % StoredRating.generate(diff),)
+        return '\t'.join(values) + '\n'
+
+class WatermarkPhrase:
+    @classmethod
+    def generate(self, table, id):
+        return "INSERT INTO %s VALUES('%s', '%s', '%s', '%s', '%s', '%s', '%s') "\
+               "ON CONFLICT (TableName) DO UPDATE SET Year=EXCLUDED.Year, MonthDay=EXCLUDED.MonthDay, JyoCD=EXCLUDED.JyoCD, "\
+               "Kaiji=EXCLUDED.Kaiji, Nichiji=EXCLUDED.Nichiji, RaceNum=EXCLUDED.RaceNum;" % ((watermark_table, table) + id)
+
+class RatingDeletePhrase:
+    @classmethod
+    def generate(self, table, fromyearmonthday):
+        return 'DELETE FROM %s WHERE%s' % (table, DateFilter.generate_condition_older(fromyearmonthday))
+
+class LatestRatingReference:
+    __cols = 'kettonum, rating'
+
+    def __init__(self, table, yearmonthday, dialect='postgresql', kettonum_list=None):
+        conditions = IDFilterUntilToday.generate_phrase((yearmonthday[:4], yearmonthday[4:]))
+        if kettonum_list is not None:
+            conditions += ' AND' + KettonumFilter.generate_phrase(kettonum_list)
+
+        if dialect == 'sqlite':
+            # no DISTINCT ON in SQLite, pick the latest row per horse with a window instead
+            self.table      = '(SELECT kettonum, rating, row_number() OVER (PARTITION BY kettonum ORDER BY year DESC, monthday DESC) AS latest'\
+                              ' FROM %s WHERE%s)' % (table, conditions)
+            self.cols       = LatestRatingReference.__cols
+            self.conditions = 'latest=1'
+            self.order      = ''
+            self.limit      = ''
+            return
+
+        self.table      = table
+        self.cols       = 'DISTINCT ON (kettonum) ' + LatestRatingReference.__cols
+        self.conditions = conditions
+        self.order      = 'kettonum, year DESC, monthday DESC'
+        self.limit      = ''
+
+    @classmethod
+    def index(self, colname):
+        return self.__cols.strip().split(', ').index(colname)
+
+class RatingExistanceReference:
+    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum, kettonum, rating'
+
+    def __init__(self, table, fromyearmonthday):
+        self.table      = table
+        self.cols       = RatingExistanceReference.__cols
+        self.conditions = DateFilter.generate_condition_older(fromyearmonthday)
+        self.order      = 'year ASC, monthday ASC'
+        self.limit      = ''
+
+    @classmethod
+    def index(self, colname):
+        return self.__cols.strip().split(', ').index(colname)
+
+class WatermarkReference:
+    __cols = 'year, monthday, jyocd, kaiji, nichiji, racenum'
+
+    def __init__(self, table):
+        self.table      = watermark_table
+        self.cols       = WatermarkReference.__cols
+        self.conditions = "tablename='%s'" % table
+        self.order      = ''
+        self.limit      = ''
+
+    @classmethod
+    def index(self, colname):
+        return self.__cols.strip().split(', ').index(colname)
+
+class CurrentRatingReader:
+    itersize = 50000
+
+    @classmethod
+    def load_data(self, table, fromyearmonthday, rating_state, connection):
+        # races are written in order, so the computed ones are a prefix of the run
+        # and folding their ratings into rating_state leaves it ready for the rest
+        id_set = set()
+
+        with connection.cursor('current_rating_reader') as cur:
+            cur.itersize = self.itersize
+            query = SelectPhrase.generate(RatingExistanceReference(table, fromyearmonthday))
+            cur.execute(query)
+
+            for row in cur:
+                id_set.add(tuple(row[:6]))
+                rating_state.update([row[RatingExistanceReference.index('kettonum')]],
+                                    [row[RatingExistanceReference.index('rating')]], tuple(row[:6]))
+
+        return id_set
+
+class WatermarkReader:
+    @classmethod
+    def load_data(self, table, connection):
+        with connection.cursor() as cur:
+            query = SelectPhrase.generate(WatermarkReference(table))
+            cur.execute(query)
+            row = cur.fetchone()
+
+        return tuple(row) if row else None
+
+class WatermarkWriter:
+    @classmethod
+    def write_data(self, table, id, connection):
+        with connection.cursor() as cur:
+            query = WatermarkPhrase.generate(table, id)
+            cur.execute(query)
+        connection.commit()
+
+class RatingEraser:
+    @classmethod
+    def write_data(self, table, fromyearmonthday, connection):
+        with connection.cursor() as cur:
+            query = RatingDeletePhrase.generate(table, fromyearmonthday)
+            cur.execute(query)
+        connection.commit()
+
+class RatingState:
+    initial_rating = 1400
+    kettonum_chunk_size = 1000
+
+    def __init__(self, table):
+        self.table = table
+        self.rating_dict = dict()
+        # q = 10**(r/400) next to each rating, recomputed only when the rating changes
+        self.strength_dict = dict()
+        self.initial_strength = RatingState.strength(self.initial_rating)
+        # RaceOrder key of the race each rating came from, '' when it was loaded without one
+        self.race_key_dict = dict()
+        # a restored checkpoint stays in its memory-mapped arrays, sorted by kettonum; a horse
+        # moves into the dicts above the first time it runs again
+        self.checkpoint_kettonum = None
+
+    @classmethod
+    def strength(self, rating):
+        return pow(10, rating / 400.0)
+
+    def __set(self, kettonum, rating):
+        if self.rating_dict.get(kettonum) != rating:
+            self.rating_dict[kettonum] = rating
+            self.strength_dict[kettonum] = RatingState.strength(rating)
+
+    def load_data(self, fromyearmonthday, connection, kettonum_list=None):
+        # kettonum_list limits the load to those horses, a few IN lists at a time
+        if kettonum_list is None:
+            chunk_list = [None]
+        else:
+            chunk_list = [kettonum_list[begin:begin + self.kettonum_chunk_size] for begin in range(0, len(kettonum_list), self.kettonum_chunk_size)]
+
+        for chunk in chunk_list:
+            with connection.cursor('rating_state_cursor') as cur:
+                query = SelectPhrase.generate(LatestRatingReference(self.table, fromyearmonthday, connection.dialect, chunk))
+                cur.execute(query)
+                for row in cur:
+                    self.__set(row[LatestRatingReference.index('kettonum')], row[LatestRatingReference.index('rating')])
+
+    def load_index(self, rating_index, fromyearmonthday):
+        kettonum_array, rating_array = rating_index.get_all(fromyearmonthday)
+        for kettonum, rating in zip(kettonum_array.tolist(), rating_array.tolist()):
+            self.__set(kettonum, rating)
+
+    def load_checkpoint(self, kettonum_array, rating_array, race_key_array):
+        # nothing is read here, restoring is independent of the number of horses
+        if len(kettonum_array):
+            self.checkpoint_kettonum = kettonum_array
+            self.checkpoint_rating = rating_array
+            self.checkpoint_race_key = race_key_array
+
+    def __restore(self, kettonum_list):
+        # binary search the checkpoint for the horses of a race that have not run since
+        missing_list = [kettonum for kettonum in kettonum_list if kettonum not in self.rating_dict]
+        if not missing_list:
+            return
+
+        index = np.minimum(np.searchsorted(self.checkpoint_kettonum, missing_list), len(self.checkpoint_kettonum) - 1)
+        for kettonum, found, rating, race_key in zip(missing_list, self.checkpoint_kettonum[index].tolist(),
+                                                     self.checkpoint_rating[index].tolist(), self.checkpoint_race_key[index].tolist()):
+            if kettonum != found:
+                continue
+            self.__set(kettonum, rating)
+            if race_key:
+                self.race_key_dict[kettonum] = race_key
+
+    def checkpoint(self):
+        kettonum = np.array(list(self.rating_dict), dtype='U10')
+        rating = np.array([self.rating_dict[kettonum] for kettonum in kettonum.tolist()], dtype=np.int32)
+        race_key = np.array([self.race_key_dict.get(kettonum, '') for kettonum in kettonum.tolist()], dtype='U16')
+
+        if self.checkpoint_kettonum is not None:
+            # the restored horses that have not run since
+            kept = ~np.isin(self.checkpoint_kettonum, kettonum)
+            kettonum = np.concatenate((kettonum, self.checkpoint_kettonum[kept]))
+            rating = np.concatenate((rating, self.checkpoint_rating[kept]))
+            race_key = np.concatenate((race_key, self.checkpoint_race_key[kept]))
+
+        # sorted by kettonum, which is what load_checkpoint searches on
+        order = np.argsort(kettonum, kind='stable')
+        return kettonum[order], rating[order], race_key[order]
+
+    def get(self, kettonum_list):
+        if self.checkpoint_kettonum is not None:
+            self.__restore(kettonum_list)
+        return [self.rating_dict.get(kettonum, self.initial_rating) for kettonum in kettonum_list]
+
+    def get_strength(self, kettonum_list):
+        if self.checkpoint_kettonum is not None:
+            self.__restore(kettonum_list)
+        return [self.strength_dict.get(kettonum, self.initial_strength) for kettonum in kettonum_list]
+
+    def update(self, kettonum_list, rating_list, id=None):
+        for kettonum, rating in zip(kettonum_list, rating_list):
+            self.__set(kettonum, StoredRating.generate(rating))
+
+        if id is not None:
+            race_key = ''.join(RaceOrder.key(id))
+            for kettonum in kettonum_list:
+                self.race_key_dict[kettonum] = race_key
+
+class RatingWriter:
+    flush_threshold = 20000
+
+    def __init__(self, connection, table, with_diff, flush_threshold=None):
+        self.connection = connection
+        self.table = table
+        self.with_diff = with_diff
+        self.flush_threshold = flush_threshold or RatingWriter.flush_threshold
+        self.buffer = io.StringIO()
+        self.row_count = 0
+
+    def write_data(self, id, kettonum_list, rating_list, rating_diff_list):
+        for kettonum, rating, diff in zip(kettonum_list, rating_list, rating_diff_list):
+            self.buffer.write(CopyPhrase.generate(id, kettonum, rating, diff if self.with_diff else None))
+            self.row_count += 1
+
+        if self.row_count >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.row_count == 0:
+            return
+
+        self.buffer.seek(0)
+        self.connection.copy_from(self.table, self.buffer)
+        self.connection.commit()
+
+        self.buffer = io.StringIO()
+        self.row_count = 0
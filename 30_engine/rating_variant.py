@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from race_source import RaceOrder, TrackcdRange
+from stage_timer import stage_timer
+from rating_table import CurrentRatingReader, RatingState, RatingWriter, WatermarkWriter
+from rating_index import RatingIndexReader
+from race_batch import RaceBatch
+from rating_checkpoint import CheckpointWriter
+
+class Surface:
+    @classmethod
+    def any(cls, trackcd):
+        return True
+
+    @classmethod
+    def shiba(cls, trackcd):
+        return trackcd.isdigit() and trackcd != '00' and int(trackcd) <= 22
+
+    @classmethod
+    def dirt_early(cls, trackcd):
+        return trackcd.isdigit() and 22 < int(trackcd) <= 26
+
+    @classmethod
+    def dirt(cls, trackcd):
+        return trackcd.isdigit() and 22 < int(trackcd) <= 29
+
+    @classmethod
+    def syogai(cls, trackcd):
+        return trackcd.isdigit() and 51 <= int(trackcd) <= 59
+
+    @classmethod
+    def generate_phrase(cls, surface):
+        # superset of the surface in SQL, so each stream only reads its own races
+        phrase_dict = {
+            cls.any: '',
+            cls.shiba: TrackcdRange('01', '22'),
+            cls.dirt_early: TrackcdRange('23', '26'),
+            cls.dirt: TrackcdRange('23', '29'),
+            cls.syogai: TrackcdRange('51', '59'),
+        }
+        return phrase_dict[surface]
+
+class Expectation:
+    @classmethod
+    def generate(self, rating_list, strength_list=None):
+        if strength_list is None:
+            return lambda rating_op, rating: 1.0 / (1 + pow(10, (rating_op - rating) / 400.0 ))
+
+        # q = 10**(r/400) comes precomputed from RatingState and one rating maps to one q,
+        # so the pairwise expectation is q / (q + q_op) with no pow in the loop.
+        # 0 stands for a missing 2nd/3rd place and 10**0 is 1
+        strength = {0: 1.0}
+        strength.update(zip(rating_list, strength_list))
+        return lambda rating_op, rating: strength[rating] / (strength[rating] + strength[rating_op])
+
+class IndiscriminateCalculator:
+    k_factor = 32
+
+    @classmethod
+    def estimate(self, rating_list, kakuteijyuni_list, strength_list=None):
+        new_rating_list = list()
+        rating_diff_list = list()
+        expect = Expectation.generate(rating_list, strength_list)
+
+        for rating, jyuni in zip(rating_list, kakuteijyuni_list):
+            actual_sum = 0
+            expect_sum = 0
+
+            for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                if jyuni == jyuni_op:
+                    continue
+
+                actual_sum += 1.0 if jyuni < jyuni_op else 0.0
+                expect_sum += expect(rating_op, rating)
+
+            match_num = len(rating_list) - 1
+            new_rating = rating + self.k_factor * (actual_sum - expect_sum) / match_num
+
+            new_rating_list.append(new_rating)
+            rating_diff_list.append(new_rating - rating)
+
+        return new_rating_list, rating_diff_list
+
+    @classmethod
+    def estimate_batch(self, batch):
+        # estimate over every race of a RaceBatch at once; valid marks the races computed here
+        match_mask = batch.jyuni[batch.left] != batch.jyuni[batch.right]
+        expect_sum = batch.sum_pairs(np.where(match_mask, batch.expect_pairs(), 0.0))
+        actual_sum = batch.count_pairs(batch.jyuni[batch.left] < batch.jyuni[batch.right])
+
+        new_rating = batch.rating + self.k_factor * (actual_sum - expect_sum) / (batch.match_num - 1)
+
+        return new_rating, new_rating - batch.rating, batch.size > 1
+
+class WinnerCalculator:
+    k_factor = 32
+
+    @classmethod
+    def estimate(self, rating_list, kakuteijyuni_list, strength_list=None):
+        assert(len(rating_list) == len(kakuteijyuni_list))
+        new_rating_list = list()
+        rating_diff_list = list()
+        expect = Expectation.generate(rating_list, strength_list)
+
+        rating_top = 0
+        for rating, jyuni in zip(rating_list, kakuteijyuni_list):
+            if jyuni == '01':
+                rating_top = rating
+                break
+
+        if rating_top == 0:
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        for rating, jyuni in zip(rating_list, kakuteijyuni_list):
+            actual_sum = 0
+            expect_sum = 0
+
+            if jyuni == '01':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 1
+                new_rating = rating + self.k_factor * (actual_sum - expect_sum) 
+
+            else:
+                new_rating = rating + self.k_factor * (0 - expect(rating_top, rating))
+
+            new_rating_list.append(new_rating)
+            rating_diff_list.append(new_rating - rating)
+
+        return new_rating_list, rating_diff_list
+
+class TopThreeCalculator:
+    vectorized = False
+
+    @classmethod
+    def estimate(self, rating_list, kakuteijyuni_list, strength_list=None):
+        if self.vectorized:
+            return self.estimate_vectorized(rating_list, kakuteijyuni_list, strength_list)
+
+        assert(len(rating_list) == len(kakuteijyuni_list))
+
+        new_rating_list = list(rating_list)
+        rating_diff_list = [0] * len(rating_list)
+
+        k_factor_first = 16
+        k_factor_second = 8
+        k_factor_third = 4
+
+        rating_first = 0
+        rating_second = 0
+        rating_third = 0
+
+        for rating, jyuni in zip(rating_list, kakuteijyuni_list):
+            if jyuni == '01':
+                rating_first = rating
+
+            elif jyuni == '02':
+                rating_second = rating
+
+            elif jyuni == '03':
+                rating_third = rating
+
+        if rating_first == 0:
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        expect = Expectation.generate(rating_list, strength_list)
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        for index, rating, jyuni in zip(range(len(rating_list)), rating_list, kakuteijyuni_list):
+            actual_sum = 0
+            expect_sum = 0
+            new_rating = 0
+
+            if jyuni == '01':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 1
+
+                new_rating = rating + reword(k_factor_first, actual_sum, expect_sum) 
+
+            elif jyuni == '02':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == '01':
+                        continue
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 2
+
+                new_rating = rating\
+                            + reword(k_factor_first, 0, expect(rating_first, rating))\
+                            + reword(k_factor_second, actual_sum, expect_sum) 
+
+            elif jyuni == '03':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == '01':
+                        continue
+                    if jyuni == '02':
+                        continue
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 3
+
+                new_rating = rating\
+                            + reword(k_factor_first, 0, expect(rating_first, rating))\
+                            + reword(k_factor_second, 0, expect(rating_second, rating))\
+                            + reword(k_factor_third, actual_sum, expect_sum) 
+
+            else:
+                new_rating = rating\
+                            + reword(k_factor_first, 0, expect(rating_first, rating))\
+                            + reword(k_factor_second, 0, expect(rating_second, rating))\
+                            + reword(k_factor_third, 0, expect(rating_third, rating))
+
+            new_rating_list[index] = new_rating
+            rating_diff_list[index] = new_rating - rating
+
+        return new_rating_list, rating_diff_list
+
+    @classmethod
+    def __rating_at(self, rating, jyuni, target):
+        index = np.flatnonzero(jyuni == target)
+        return rating[index[-1]] if len(index) else 0
+
+    @classmethod
+    def estimate_vectorized(self, rating_list, kakuteijyuni_list, strength_list=None):
+        assert(len(rating_list) == len(kakuteijyuni_list))
+
+        k_factor_first = 16
+        k_factor_second = 8
+        k_factor_third = 4
+
+        rating = np.array(rating_list, dtype=np.float64)
+        jyuni = np.array(kakuteijyuni_list)
+        match_num = len(rating_list)
+
+        rating_first = TopThreeCalculator.__rating_at(rating, jyuni, '01')
+        rating_second = TopThreeCalculator.__rating_at(rating, jyuni, '02')
+        rating_third = TopThreeCalculator.__rating_at(rating, jyuni, '03')
+
+        if rating_first == 0:
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        if strength_list is None:
+            # float_power (unlike np.power) goes through libm pow, same as the loop implementation
+            expect = lambda rating_op, rating: 1.0 / (1 + np.float_power(10.0, (rating_op - rating) / 400.0 ))
+            operand, operand_first, operand_second, operand_third = rating, rating_first, rating_second, rating_third
+        else:
+            # q = 10**(r/400) kept by RatingState: q / (q + q_op), no exponentials at all.
+            # a missing 2nd/3rd place counts as rating 0, whose q is 1
+            expect = lambda strength_op, strength: strength / (strength + strength_op)
+            operand = np.array(strength_list, dtype=np.float64)
+            operand_first, operand_second, operand_third = [TopThreeCalculator.__rating_at(operand, jyuni, target) or 1.0 for target in ['01', '02', '03']]
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        # expect_matrix[i, j]: expectation of horse i against opponent j, ties excluded
+        match_mask = jyuni[:, None] != jyuni[None, :]
+        expect_matrix = np.where(match_mask, expect(operand[None, :], operand[:, None]), 0.0)
+        # accumulate left to right so the sums match the loop implementation bit for bit
+        expect_sum = np.add.accumulate(expect_matrix, axis=1)[:, -1]
+
+        expect_first = expect(operand_first, operand)
+        expect_second = expect(operand_second, operand)
+        expect_third = expect(operand_third, operand)
+
+        new_rating = np.select(
+            [jyuni == '01', jyuni == '02', jyuni == '03'],
+            [rating\
+             + reword(k_factor_first, match_num - 1, expect_sum),
+             rating\
+             + reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, match_num - 2, expect_sum),
+             rating\
+             + reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, 0, expect_second)\
+             + reword(k_factor_third, match_num - 3, expect_sum)],
+            rating\
+            + reword(k_factor_first, 0, expect_first)\
+            + reword(k_factor_second, 0, expect_second)\
+            + reword(k_factor_third, 0, expect_third))
+
+        return new_rating.tolist(), (new_rating - rating).tolist()
+
+    @classmethod
+    def estimate_batch(self, batch):
+        # estimate_vectorized over every race of a RaceBatch at once; valid marks the races computed here
+        k_factor_first = 16
+        k_factor_second = 8
+        k_factor_third = 4
+
+        rating = batch.rating
+        jyuni = batch.jyuni
+        match_num = batch.match_num
+        valid = batch.place(rating, '01')[batch.begin] != 0
+
+        operand = batch.operand()
+        operand_first, operand_second, operand_third = [batch.place(operand, target, batch.missing_operand()) for target in ['01', '02', '03']]
+        expect = batch.expect
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        match_mask = jyuni[batch.left] != jyuni[batch.right]
+        expect_sum = batch.sum_pairs(np.where(match_mask, batch.expect_pairs(), 0.0))
+
+        expect_first = expect(operand_first, operand)
+        expect_second = expect(operand_second, operand)
+        expect_third = expect(operand_third, operand)
+
+        new_rating = np.select(
+            [jyuni == '01', jyuni == '02', jyuni == '03'],
+            [rating\
+             + reword(k_factor_first, match_num - 1, expect_sum),
+             rating\
+             + reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, match_num - 2, expect_sum),
+             rating\
+             + reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, 0, expect_second)\
+             + reword(k_factor_third, match_num - 3, expect_sum)],
+            rating\
+            + reword(k_factor_first, 0, expect_first)\
+            + reword(k_factor_second, 0, expect_second)\
+            + reword(k_factor_third, 0, expect_third))
+
+        return new_rating, new_rating - rating, valid
+
+class TopThreeOtherCalculator:
+    vectorized = False
+
+    @classmethod
+    def estimate(self, rating_list, kakuteijyuni_list, strength_list=None):
+        if self.vectorized:
+            return self.estimate_vectorized(rating_list, kakuteijyuni_list, strength_list)
+
+        assert(len(rating_list) == len(kakuteijyuni_list))
+
+        new_rating_list = list(rating_list)
+        rating_diff_list = [0] * len(rating_list)
+
+        k_factor_first = 16
+        k_factor_second = 12
+        k_factor_third = 8
+        k_factor_other = 4
+
+        rating_first = 0
+        rating_second = 0
+        rating_third = 0
+
+        for rating, jyuni in zip(rating_list, kakuteijyuni_list):
+            if jyuni == '01':
+                rating_first = rating
+
+            elif jyuni == '02':
+                rating_second = rating
+
+            elif jyuni == '03':
+                rating_third = rating
+
+        if rating_first == 0:
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        expect = Expectation.generate(rating_list, strength_list)
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        for index, rating, jyuni in zip(range(len(rating_list)), rating_list, kakuteijyuni_list):
+            actual_sum = 0
+            expect_sum = 0
+            rating_diff = 0
+
+            if jyuni == '01':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 1
+
+                rating_diff = reword(k_factor_first, actual_sum, expect_sum) 
+
+            elif jyuni == '02':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == '01':
+                        continue
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 2
+
+                rating_diff = reword(k_factor_first, 0, expect(rating_first, rating))\
+                            + reword(k_factor_second, actual_sum, expect_sum) 
+
+            elif jyuni == '03':
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == '01':
+                        continue
+                    if jyuni == '02':
+                        continue
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+
+                actual_sum = len(rating_list) - 3
+
+                rating_diff = reword(k_factor_first, 0, expect(rating_first, rating))\
+                            + reword(k_factor_second, 0, expect(rating_second, rating))\
+                            + reword(k_factor_third, actual_sum, expect_sum) 
+
+            else:
+                for rating_op, jyuni_op in zip(rating_list, kakuteijyuni_list):
+                    if jyuni == '01':
+                        continue
+                    if jyuni == '02':
+                        continue
+                    if jyuni == '03':
+                        continue
+                    if jyuni == jyuni_op:
+                        continue
+                    expect_sum += expect(rating_op, rating)
+                    actual_sum += 1 if int(jyuni) < int(jyuni_op) else 0
+
+                rating_diff = reword(k_factor_first, 0, expect(rating_first, rating))\
+                            + reword(k_factor_second, 0, expect(rating_second, rating))\
+                            + reword(k_factor_third, 0, expect(rating_third, rating))\
+                            + reword(k_factor_other, actual_sum, expect_sum)
+
+            new_rating_list[index] = rating + rating_diff
+            rating_diff_list[index] = rating_diff
+
+        return new_rating_list, rating_diff_list
+
+    @classmethod
+    def __rating_at(self, rating, jyuni, target):
+        index = np.flatnonzero(jyuni == target)
+        return rating[index[-1]] if len(index) else 0
+
+    @classmethod
+    def estimate_vectorized(self, rating_list, kakuteijyuni_list, strength_list=None):
+        assert(len(rating_list) == len(kakuteijyuni_list))
+
+        k_factor_first = 16
+        k_factor_second = 12
+        k_factor_third = 8
+        k_factor_other = 4
+
+        rating = np.array(rating_list, dtype=np.float64)
+        jyuni = np.array(kakuteijyuni_list)
+        match_num = len(rating_list)
+
+        rating_first = TopThreeOtherCalculator.__rating_at(rating, jyuni, '01')
+        rating_second = TopThreeOtherCalculator.__rating_at(rating, jyuni, '02')
+        rating_third = TopThreeOtherCalculator.__rating_at(rating, jyuni, '03')
+
+        if rating_first == 0:
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        if strength_list is None:
+            # float_power (unlike np.power) goes through libm pow, same as the loop implementation
+            expect = lambda rating_op, rating: 1.0 / (1 + np.float_power(10.0, (rating_op - rating) / 400.0 ))
+            operand, operand_first, operand_second, operand_third = rating, rating_first, rating_second, rating_third
+        else:
+            # q = 10**(r/400) kept by RatingState: q / (q + q_op), no exponentials at all.
+            # a missing 2nd/3rd place counts as rating 0, whose q is 1
+            expect = lambda strength_op, strength: strength / (strength + strength_op)
+            operand = np.array(strength_list, dtype=np.float64)
+            operand_first, operand_second, operand_third = [TopThreeOtherCalculator.__rating_at(operand, jyuni, target) or 1.0 for target in ['01', '02', '03']]
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        # expect_matrix[i, j]: expectation of horse i against opponent j, ties excluded
+        match_mask = jyuni[:, None] != jyuni[None, :]
+        expect_matrix = np.where(match_mask, expect(operand[None, :], operand[:, None]), 0.0)
+        # accumulate left to right so the sums match the loop implementation bit for bit
+        expect_sum = np.add.accumulate(expect_matrix, axis=1)[:, -1]
+
+        expect_first = expect(operand_first, operand)
+        expect_second = expect(operand_second, operand)
+        expect_third = expect(operand_third, operand)
+
+        if np.any((jyuni != '01') & (jyuni != '02') & (jyuni != '03')):
+            order = np.array([int(j) for j in kakuteijyuni_list])
+            actual_sum_other = ((order[:, None] < order[None, :]) & match_mask).sum(axis=1)
+        else:
+            actual_sum_other = np.zeros(match_num)
+
+        rating_diff = np.select(
+            [jyuni == '01', jyuni == '02', jyuni == '03'],
+            [reword(k_factor_first, match_num - 1, expect_sum),
+             reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, match_num - 2, expect_sum),
+             reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, 0, expect_second)\
+             + reword(k_factor_third, match_num - 3, expect_sum)],
+            reword(k_factor_first, 0, expect_first)\
+            + reword(k_factor_second, 0, expect_second)\
+            + reword(k_factor_third, 0, expect_third)\
+            + reword(k_factor_other, actual_sum_other, expect_sum))
+
+        new_rating = rating + rating_diff
+
+        return new_rating.tolist(), rating_diff.tolist()
+
+    @classmethod
+    def estimate_batch(self, batch):
+        # estimate_vectorized over every race of a RaceBatch at once; valid marks the races computed here
+        k_factor_first = 16
+        k_factor_second = 12
+        k_factor_third = 8
+        k_factor_other = 4
+
+        rating = batch.rating
+        jyuni = batch.jyuni
+        match_num = batch.match_num
+
+        # every place is read as a number here, a race with anything else is left to estimate
+        digit = np.char.isdigit(jyuni)
+        valid = (batch.place(rating, '01')[batch.begin] != 0) & np.logical_and.reduceat(digit, batch.begin)
+        order = np.where(digit, jyuni, '0').astype(np.int64)
+
+        operand = batch.operand()
+        operand_first, operand_second, operand_third = [batch.place(operand, target, batch.missing_operand()) for target in ['01', '02', '03']]
+        expect = batch.expect
+        reword = lambda k_factor, actual, expect: k_factor * (actual - expect)
+
+        match_mask = jyuni[batch.left] != jyuni[batch.right]
+        expect_sum = batch.sum_pairs(np.where(match_mask, batch.expect_pairs(), 0.0))
+        actual_sum_other = batch.count_pairs((order[batch.left] < order[batch.right]) & match_mask)
+
+        expect_first = expect(operand_first, operand)
+        expect_second = expect(operand_second, operand)
+        expect_third = expect(operand_third, operand)
+
+        rating_diff = np.select(
+            [jyuni == '01', jyuni == '02', jyuni == '03'],
+            [reword(k_factor_first, match_num - 1, expect_sum),
+             reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, match_num - 2, expect_sum),
+             reword(k_factor_first, 0, expect_first)\
+             + reword(k_factor_second, 0, expect_second)\
+             + reword(k_factor_third, match_num - 3, expect_sum)],
+            reword(k_factor_first, 0, expect_first)\
+            + reword(k_factor_second, 0, expect_second)\
+            + reword(k_factor_third, 0, expect_third)\
+            + reword(k_factor_other, actual_sum_other, expect_sum))
+
+        return rating + rating_diff, rating_diff, valid
+
+class RecordKeeper:
+    def __init__(self, comp_func):
+        self.record = 1400
+        self.kettonum = '--------'
+        self.comp_func_ = comp_func
+        self.changed_ = False
+
+    def update(self, kettonum, score):
+        if self.comp_func_(score, self.record):
+            self.record = score
+            self.kettonum = kettonum
+            self.changed_ = True
+
+        return self.kettonum, self.record
+
+    def changed(self):
+        c = self.changed_
+        self.changed_ = False
+        return c
+
+class RatingVariant:
+    as_of_index = False
+    cached_strength = False
+    batch = False
+
+    def __init__(self, table, calculator, surface, with_diff=False):
+        self.table = table
+        self.calculator = calculator
+        self.surface = surface
+        self.with_diff = with_diff
+        self.watermark = None
+
+    def open(self, fromyearmonthday, connection, checkpoint=None, kettonum_list=None):
+        self.connection = connection
+        self.rating_state = RatingState(self.table)
+        with stage_timer.measure('rating_state.load'):
+            if checkpoint is not None:
+                watermark, kettonum_array, rating_array, race_key_array = checkpoint
+                self.rating_state.load_checkpoint(kettonum_array, rating_array, race_key_array)
+            elif self.as_of_index:
+                self.rating_state.load_index(RatingIndexReader.load_data(self.table, connection, fromyearmonthday), fromyearmonthday)
+            else:
+                self.rating_state.load_data(fromyearmonthday, connection, kettonum_list)
+        with stage_timer.measure('current_rating.load'):
+            self.computed_id_set = CurrentRatingReader.load_data(self.table, fromyearmonthday, self.rating_state, connection)
+        # the state is ahead of the stream up to here: races skipped by the watermark and rows folded in above
+        loaded_list = [id[0] + id[1] for id in self.computed_id_set]
+        if self.watermark is not None:
+            loaded_list.append(self.watermark[0] + self.watermark[1])
+        self.loaded_until = max(loaded_list, default='')
+        self.rating_writer = RatingWriter(connection, self.table, self.with_diff)
+
+        self.record_min = RecordKeeper( lambda x, record_value: x < record_value )
+        self.record_max = RecordKeeper( lambda x, record_value: x > record_value )
+        self.count = 0
+        self.last_id = None
+
+    def update(self, id, trackcd, kettonum_list, kakuteijyuni_list):
+        self.commit(id, kettonum_list, self.compute(id, trackcd, kettonum_list, kakuteijyuni_list))
+
+    def __admit(self, id, trackcd):
+        # None for races before the watermark, False for seen but skipped races
+        if self.watermark is not None and RaceOrder.key(id) <= RaceOrder.key(self.watermark):
+            return None
+
+        if not self.surface(trackcd):
+            return False
+
+        if id in self.computed_id_set:
+            return False
+
+        return True
+
+    def compute(self, id, trackcd, kettonum_list, kakuteijyuni_list):
+        # reads the rating state only, so races without common horses can be computed in any order;
+        # returns None for races before the watermark, False for seen but skipped races
+        admitted = self.__admit(id, trackcd)
+        if admitted is not True:
+            return admitted
+
+        try:
+            entry_num = len(kettonum_list)
+            with stage_timer.measure('rating_state.get', entry_num):
+                rating_list = self.rating_state.get(kettonum_list)
+
+            with stage_timer.measure('estimate', entry_num):
+                if self.cached_strength:
+                    strength_list = self.rating_state.get_strength(kettonum_list)
+                    return self.calculator.estimate(rating_list, kakuteijyuni_list, strength_list)
+                else:
+                    return self.calculator.estimate(rating_list, kakuteijyuni_list)
+
+        except RuntimeError as e:
+            print(self.table, id, e)
+            return False
+
+    def compute_level(self, race_list):
+        # compute() for races sharing no horse, the regular ones in a single estimate_batch call
+        if not self.batch or not hasattr(self.calculator, 'estimate_batch'):
+            return [self.compute(*race) for race in race_list]
+
+        result_list = [self.__admit(id, trackcd) for id, trackcd, kettonum_list, kakuteijyuni_list in race_list]
+        batch_index_list = [index for index, race in enumerate(race_list) if result_list[index] is True and len(race[2]) > 1]
+
+        if batch_index_list:
+            kettonum_list_list = [race_list[index][2] for index in batch_index_list]
+            kakuteijyuni_list_list = [race_list[index][3] for index in batch_index_list]
+            entry_num = sum(len(kettonum_list) for kettonum_list in kettonum_list_list)
+
+            with stage_timer.measure('rating_state.get', entry_num):
+                rating_list_list = [self.rating_state.get(kettonum_list) for kettonum_list in kettonum_list_list]
+                strength_list_list = [self.rating_state.get_strength(kettonum_list) for kettonum_list in kettonum_list_list] if self.cached_strength else None
+
+            with stage_timer.measure('estimate', entry_num):
+                batch = RaceBatch(rating_list_list, kakuteijyuni_list_list, strength_list_list)
+                new_rating, rating_diff, valid = self.calculator.estimate_batch(batch)
+
+            for index, new_rating_list, rating_diff_list, batched in zip(batch_index_list, batch.split(new_rating), batch.split(rating_diff), valid.tolist()):
+                result_list[index] = (new_rating_list, rating_diff_list) if batched else True
+
+        # what the batch did not take (invalid data, single starters) goes through compute as usual
+        return [self.compute(*race) if result is True else result for race, result in zip(race_list, result_list)]
+
+    def commit(self, id, kettonum_list, result):
+        if result is None:
+            return
+
+        if self.last_id is None or RaceOrder.key(id) > RaceOrder.key(self.last_id):
+            self.last_id = id
+
+        if result is False:
+            return
+
+        new_rating_list, rating_diff_list = result
+        entry_num = len(kettonum_list)
+        with stage_timer.measure('rating_writer.write', entry_num):
+            self.rating_writer.write_data(id, kettonum_list, new_rating_list, rating_diff_list)
+        with stage_timer.measure('rating_state.update', entry_num):
+            self.rating_state.update(kettonum_list, new_rating_list, id)
+
+        for rating, kettonum in zip(new_rating_list, kettonum_list):
+            self.record_min.update(kettonum, rating)
+            self.record_max.update(kettonum, rating)
+
+        self.count = self.count + 1
+
+    def checkpoint(self, path):
+        # rows first, so every race the checkpoint covers is also in the table
+        with stage_timer.measure('rating_writer.write'):
+            self.rating_writer.flush()
+
+        with stage_timer.measure('checkpoint.write'):
+            CheckpointWriter.write_data(path, self.last_id or self.watermark, *self.rating_state.checkpoint())
+
+    def close(self):
+        with stage_timer.measure('rating_writer.write'):
+            self.rating_writer.flush()
+
+        if self.last_id is not None:
+            with stage_timer.measure('watermark.write'):
+                WatermarkWriter.write_data(self.table, self.last_id, self.connection)
+
+variant_list = [
+    RatingVariant('uma_rating_02', IndiscriminateCalculator, Surface.any),
+    RatingVariant('uma_rating_03', IndiscriminateCalculator, Surface.shiba),
+    RatingVariant('uma_rating_04', IndiscriminateCalculator, Surface.dirt_early),
+    RatingVariant('uma_rating_05', WinnerCalculator, Surface.shiba),
+    RatingVariant('uma_rating_06', WinnerCalculator, Surface.dirt_early),
+    RatingVariant('uma_rating_10', TopThreeCalculator, Surface.shiba),
+    RatingVariant('uma_rating_11', TopThreeCalculator, Surface.dirt),
+    RatingVariant('uma_rating_12', TopThreeCalculator, Surface.syogai),
+    RatingVariant('uma_rating_20', TopThreeOtherCalculator, Surface.shiba, with_diff=True),
+    RatingVariant('uma_rating_21', TopThreeOtherCalculator, Surface.dirt, with_diff=True),
+]
@@ -0,0 +1,69 @@
+CREATE TABLE IF NOT EXISTS n_race
+(
+    Year char(4),
+    MonthDay char(4),
+    JyoCD char(2),
+    Kaiji char(2),
+    Nichiji char(2),
+    RaceNum char(2),
+    DataKubun char(1),
+    TrackCD char(2),
+    PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum)
+);
+
+CREATE TABLE IF NOT EXISTS n_uma_race
+(
+    Year char(4),
+    MonthDay char(4),
+    JyoCD char(2),
+    Kaiji char(2),
+    Nichiji char(2),
+    RaceNum char(2),
+    DataKubun char(1),
+    Umaban char(2),
+    KettoNum char(10),
+    IJyoCD char(1),
+    KakuteiJyuni char(2),
+    PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, Umaban)
+);
+
+CREATE TABLE IF NOT EXISTS n_uma
+(
+    KettoNum char(10),
+    BirthDate char(8),
+    PRIMARY KEY (KettoNum)
+);
+
+CREATE TABLE IF NOT EXISTS uma_rating_02 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_03 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_04 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_05 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_06 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_10 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_11 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_12 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_20 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, RatingDiff SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+CREATE TABLE IF NOT EXISTS uma_rating_21 (Year char(4), MonthDay char(4), JyoCD char(2), Kaiji char(2), Nichiji char(2), RaceNum char(2), KettoNum char(10), Rating SMALLINT, RatingDiff SMALLINT, PRIMARY KEY (Year, MonthDay, JyoCD, Kaiji, Nichiji, RaceNum, KettoNum));
+
+CREATE INDEX IF NOT EXISTS uma_rating_02_kettonum_idx ON uma_rating_02 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_03_kettonum_idx ON uma_rating_03 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_04_kettonum_idx ON uma_rating_04 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_05_kettonum_idx ON uma_rating_05 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_06_kettonum_idx ON uma_rating_06 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_10_kettonum_idx ON uma_rating_10 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_11_kettonum_idx ON uma_rating_11 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_12_kettonum_idx ON uma_rating_12 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_20_kettonum_idx ON uma_rating_20 (KettoNum, Year, MonthDay);
+CREATE INDEX IF NOT EXISTS uma_rating_21_kettonum_idx ON uma_rating_21 (KettoNum, Year, MonthDay);
+
+CREATE TABLE IF NOT EXISTS uma_rating_watermark
+(
+    TableName varchar(32),
+    Year char(4),
+    MonthDay char(4),
+    JyoCD char(2),
+    Kaiji char(2),
+    Nichiji char(2),
+    RaceNum char(2),
+    PRIMARY KEY (TableName)
+);
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import re
+import json
+import time
+import signal
+import threading
+
+class StageStat:
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.elapsed = 0.0
+
+class LatencyHistogram:
+    # upper bounds in milliseconds, the last bucket takes everything slower
+    bounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.calls = 0
+        self.elapsed = 0.0
+        self.slowest = 0.0
+
+    def observe(self, elapsed):
+        msec = elapsed * 1000
+        for index, bound in enumerate(self.bounds):
+            if msec <= bound:
+                self.counts[index] += 1
+                break
+
+        self.calls += 1
+        self.elapsed += elapsed
+        self.slowest = max(self.slowest, elapsed)
+
+    def to_dict(self):
+        return {'calls': self.calls, 'elapsed': self.elapsed, 'slowest': self.slowest,
+                'buckets': {('<=%gms' % bound if bound != float('inf') else 'slower'): count for bound, count in zip(self.bounds, self.counts)}}
+
+class QueryTemplate:
+    @classmethod
+    def generate(self, query):
+        # literals differ per call (dates, kettonum, table rows), the shape of the query does not
+        query = re.sub(r'uma_rating_\d+', 'uma_rating_XX', ' '.join(query.split()))
+        return re.sub(r"'[^']*'", '?', query)
+
+class Measurement:
+    def __init__(self, stat, rows, lock):
+        self.stat = stat
+        self.rows = rows
+        self.lock = lock
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        with self.lock:
+            self.stat.elapsed += elapsed
+            self.stat.calls += 1
+            self.stat.rows += self.rows
+
+class StageTimer:
+    def __init__(self):
+        # stages may be measured from more than one thread
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.stage_dict = dict()
+        self.query_dict = dict()
+
+    def stat(self, stage):
+        with self.lock:
+            stat = self.stage_dict.get(stage)
+            if stat is None:
+                stat = self.stage_dict[stage] = StageStat()
+            return stat
+
+    def measure(self, stage, rows=0):
+        return Measurement(self.stat(stage), rows, self.lock)
+
+    def iterate(self, stage, iterable, row_count=len):
+        # time spent producing items only, not the caller's loop body
+        stat = self.stat(stage)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                with self.lock:
+                    stat.elapsed += time.perf_counter() - start
+                return
+            with self.lock:
+                stat.elapsed += time.perf_counter() - start
+                stat.calls += 1
+                stat.rows += row_count(item)
+            yield item
+
+    def observe_query(self, query, elapsed):
+        template = QueryTemplate.generate(query)
+        with self.lock:
+            histogram = self.query_dict.get(template)
+            if histogram is None:
+                histogram = self.query_dict[template] = LatencyHistogram()
+            histogram.observe(elapsed)
+
+    def summary(self):
+        # copies of the dicts, entries may be added meanwhile; no lock, the SIGUSR1 handler can
+        # interrupt a holder of it on the same thread
+        stage_item_list = list(self.stage_dict.items())
+        query_item_list = list(self.query_dict.items())
+        total = time.perf_counter() - self.start
+        lines = ['%-24s %10s %12s %10s %10s %7s' % ('stage', 'calls', 'rows', 'sec', 'avg ms', 'share')]
+        for stage, stat in sorted(stage_item_list, key=lambda item: -item[1].elapsed):
+            lines.append('%-24s %10d %12d %10.2f %10.3f %6.1f%%' % (stage, stat.calls, stat.rows, stat.elapsed,
+                         stat.elapsed * 1000 / max(stat.calls, 1), stat.elapsed * 100 / max(total, 1e-9)))
+        lines.append('%-24s %10s %12s %10.2f' % ('wall', '', '', total))
+
+        if query_item_list:
+            lines.append('')
+            lines.append('%-60s %8s %10s %10s  %s' % ('query', 'calls', 'sec', 'max ms', ' '.join('%5s' % ('%g' % bound) for bound in LatencyHistogram.bounds[:-1]) + '  slower'))
+            for template, histogram in sorted(query_item_list, key=lambda item: -item[1].elapsed):
+                lines.append('%-60s %8d %10.2f %10.1f  %s' % (template[:60], histogram.calls, histogram.elapsed, histogram.slowest * 1000,
+                             ' '.join('%5d' % count for count in histogram.counts)))
+
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        stage_item_list = list(self.stage_dict.items())
+        query_item_list = list(self.query_dict.items())
+        return {'wall': time.perf_counter() - self.start,
+                'stages': {stage: {'calls': stat.calls, 'rows': stat.rows, 'elapsed': stat.elapsed} for stage, stat in stage_item_list},
+                'queries': {template: histogram.to_dict() for template, histogram in query_item_list}}
+
+    def report(self, json_path=None):
+        print('\n' + self.summary(), flush=True)
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+
+    def install(self, json_path=None):
+        # kill -USR1 <pid> dumps the numbers so far without stopping the run
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.report(json_path))
+
+stage_timer = StageTimer()
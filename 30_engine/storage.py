@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import time
+import psycopg2
+
+from stage_timer import stage_timer
+
+class TimedCursor:
+    # execute plus the fetches, not the time the caller spends between rows
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.query = None
+        self.elapsed = 0.0
+
+    @property
+    def itersize(self):
+        return self.cursor.itersize
+
+    @itersize.setter
+    def itersize(self, itersize):
+        self.cursor.itersize = itersize
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.query is not None:
+            stage_timer.observe_query(self.query, self.elapsed)
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def __iter__(self):
+        iterator = iter(self.cursor)
+        while True:
+            start = time.perf_counter()
+            row = next(iterator, None)
+            self.elapsed += time.perf_counter() - start
+            if row is None:
+                return
+            yield row
+
+    def __timed(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.elapsed += time.perf_counter() - start
+        return result
+
+    def execute(self, query):
+        self.query = query
+        self.__timed(self.cursor.execute, query)
+
+    def fetchone(self):
+        return self.__timed(self.cursor.fetchone)
+
+    def fetchall(self):
+        return self.__timed(self.cursor.fetchall)
+
+class PostgresStorage:
+    dialect = 'postgresql'
+
+    def __init__(self, url):
+        self.connection = psycopg2.connect(url)
+
+    def cursor(self, name=None):
+        return TimedCursor(self.connection.cursor(name))
+
+    def copy_from(self, table, buffer):
+        start = time.perf_counter()
+        with self.connection.cursor() as cur:
+            cur.copy_expert('COPY %s FROM STDIN' % table, buffer)
+        stage_timer.observe_query('COPY %s FROM STDIN' % table, time.perf_counter() - start)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+class SqliteCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.itersize = cursor.arraysize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cursor.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, query):
+        self.cursor.execute(query)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+class SqliteStorage:
+    dialect = 'sqlite'
+    schema = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sqlite_schema.sql')
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        # readers keep streaming n_race while the writer commits ratings into the same file
+        self.connection.execute('PRAGMA journal_mode=WAL')
+
+        with open(self.schema) as f:
+            self.connection.executescript(f.read())
+
+    def cursor(self, name=None):
+        return TimedCursor(SqliteCursor(self.connection.cursor()))
+
+    def copy_from(self, table, buffer):
+        rows = [line.rstrip('\n').split('\t') for line in buffer]
+        if not rows:
+            return
+
+        start = time.perf_counter()
+        query = 'INSERT INTO %s VALUES(%s)' % (table, ', '.join(['?'] * len(rows[0])))
+        self.connection.executemany(query, rows)
+        stage_timer.observe_query(query, time.perf_counter() - start)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+class Storage:
+    @classmethod
+    def connect(self, url):
+        if url and url.startswith('sqlite:///'):
+            return SqliteStorage(url[len('sqlite:///'):])
+
+        return PostgresStorage(url)
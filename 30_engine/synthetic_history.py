@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import sys
+import datetime
+from tqdm import tqdm
+
+from storage import SqliteStorage
+from race_snapshot import SnapshotReference
+
+class SurfaceMix:
+    # (share of races, trackcd candidates) roughly following the JRA calendar
+    surface_list = [
+        (0.52, ['10', '11', '12', '17', '18', '20', '21']),
+        (0.44, ['23', '24', '25', '26', '27']),
+        (0.04, ['51', '52', '53', '54', '55']),
+    ]
+
+    @classmethod
+    def share(self):
+        return [share for share, trackcd_list in self.surface_list]
+
+    @classmethod
+    def trackcd(self, surface, rnd):
+        trackcd_list = self.surface_list[surface][1]
+        return trackcd_list[rnd.integers(len(trackcd_list))]
+
+class HorsePool:
+    # horses resting after a race wait in a bucket keyed by the day they come back, and are moved
+    # into the ready pool of their surface when that day is reached, so a field never scans the stable
+    def __init__(self, surface_num, rnd, career_mean, rest_min, rest_max, first_kettonum=1000000000):
+        self.rnd = rnd
+        self.career_mean = career_mean
+        self.rest_min = rest_min
+        self.rest_max = rest_max
+        self.next_kettonum = first_kettonum
+        self.ready_list = [list() for surface in range(surface_num)]
+        self.resting_dict = [dict() for surface in range(surface_num)]
+        self.released_day = [-1] * surface_num
+        self.retired = set()
+
+        self.ability = dict()
+        self.race_left = dict()
+        self.birthdate_dict = dict()
+
+    def __debut(self, surface, yearmonthday):
+        kettonum = '%010d' % self.next_kettonum
+        self.next_kettonum += 1
+
+        self.ability[kettonum] = self.rnd.normal(0.0, 1.0)
+        self.race_left[kettonum] = 1 + self.rnd.geometric(1.0 / self.career_mean)
+        self.birthdate_dict[kettonum] = '%04d0401' % (int(yearmonthday[:4]) - 2)
+
+        return kettonum
+
+    def __release(self, surface, day_index):
+        # days only move forward, so each bucket is released once
+        ready_list = self.ready_list[surface]
+        resting_dict = self.resting_dict[surface]
+        for day in range(self.released_day[surface] + 1, day_index + 1):
+            for kettonum in resting_dict.pop(day, []):
+                if kettonum not in self.retired:
+                    ready_list.append(kettonum)
+        self.released_day[surface] = max(self.released_day[surface], day_index)
+
+    def entry(self, surface, field_size, day_index, yearmonthday):
+        self.__release(surface, day_index)
+        ready_list = self.ready_list[surface]
+
+        # a random draw without replacement: swap the pick to the end and pop it
+        field = list()
+        while len(field) < field_size and ready_list:
+            index = self.rnd.integers(len(ready_list))
+            ready_list[index], ready_list[-1] = ready_list[-1], ready_list[index]
+            field.append(ready_list.pop())
+
+        while len(field) < field_size:
+            field.append(self.__debut(surface, yearmonthday))
+
+        resting_dict = self.resting_dict[surface]
+        for kettonum in field:
+            resting_dict.setdefault(day_index + self.rnd.integers(self.rest_min, self.rest_max + 1), []).append(kettonum)
+
+        return field
+
+    def retire(self, surface, field):
+        for kettonum in field:
+            self.race_left[kettonum] -= 1
+            if self.race_left[kettonum] <= 0:
+                self.retired.add(kettonum)
+
+class SqliteHistoryWriter:
+    batch_size = 100000
+
+    def __init__(self, path):
+        self.storage = SqliteStorage(path)
+        self.race_rows = list()
+        self.entry_rows = list()
+
+    def write_race(self, id, trackcd, entry_list):
+        self.race_rows.append(id + ('7', trackcd))
+        for umaban, kettonum, ijyocd, kakuteijyuni in entry_list:
+            self.entry_rows.append(id + ('7', umaban, kettonum, ijyocd, kakuteijyuni))
+
+        if len(self.entry_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.storage.connection.executemany('INSERT INTO n_race VALUES(?, ?, ?, ?, ?, ?, ?, ?)', self.race_rows)
+        self.storage.connection.executemany('INSERT INTO n_uma_race VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.entry_rows)
+        self.storage.commit()
+        self.race_rows = list()
+        self.entry_rows = list()
+
+    def close(self, birthdate_dict):
+        self.flush()
+        self.storage.connection.executemany('INSERT INTO n_uma VALUES(?, ?)', birthdate_dict.items())
+        self.storage.commit()
+        self.storage.close()
+
+class SnapshotHistoryWriter:
+    def __init__(self, path):
+        self.path = path
+        self.column_list = [list() for colname in SnapshotReference.colnames()]
+
+    def write_race(self, id, trackcd, entry_list):
+        # snapshot rows follow RaceEntryReference order: kettonum DESC inside a race
+        for umaban, kettonum, ijyocd, kakuteijyuni in sorted(entry_list, key=lambda entry: entry[1], reverse=True):
+            for column, value in zip(self.column_list, id + (trackcd, '7', kettonum, ijyocd, kakuteijyuni)):
+                column.append(value)
+
+    def close(self, birthdate_dict):
+        np.savez_compressed(self.path, **{colname: np.array(column, dtype=str) for colname, column in zip(SnapshotReference.colnames(), self.column_list)})
+
+class HistoryGenerator:
+    def __init__(self, fromyear, toyear, races_per_day, field_min, field_max, career_mean, scratch_rate, seed):
+        self.fromyear = fromyear
+        self.toyear = toyear
+        self.races_per_day = races_per_day
+        self.field_min = field_min
+        self.field_max = field_max
+        self.scratch_rate = scratch_rate
+        self.rnd = np.random.default_rng(seed)
+        self.horse_pool = HorsePool(len(SurfaceMix.surface_list), self.rnd, career_mean, rest_min=4, rest_max=12)
+
+    def __race_day_list(self):
+        day = datetime.date(self.fromyear, 1, 1)
+        while day.year <= self.toyear:
+            if day.weekday() >= 5:
+                yield day
+            day += datetime.timedelta(days=1)
+
+    def __race(self, surface, field_size, day_index, yearmonthday):
+        field = self.horse_pool.entry(surface, field_size, day_index, yearmonthday)
+
+        performance = [self.horse_pool.ability[kettonum] + self.rnd.normal(0.0, 1.0) for kettonum in field]
+        scratched = self.rnd.random(field_size) < self.scratch_rate
+
+        entry_list = list()
+        jyuni = 0
+        for index in np.argsort(performance)[::-1]:
+            if scratched[index]:
+                entry_list.append(('%02d' % (index + 1), field[index], str(self.rnd.integers(1, 5)), '00'))
+                continue
+            jyuni += 1
+            entry_list.append(('%02d' % (index + 1), field[index], '0', '%02d' % jyuni))
+
+        self.horse_pool.retire(surface, [field[index] for index in range(field_size) if not scratched[index]])
+
+        return sorted(entry_list)
+
+    def generate(self, writer):
+        # races are spread over as many racecourses as the two digit jyocd/racenum allow
+        jyo_num = min(99, max(1, (self.races_per_day + 11) // 12))
+        race_per_jyo = (self.races_per_day + jyo_num - 1) // jyo_num
+        assert race_per_jyo <= 99, 'races_per_day is too large for jyocd/racenum'
+
+        race_num = 0
+        entry_num = 0
+        for day_index, day in enumerate(tqdm(list(self.__race_day_list()), desc='Generating race days')):
+            year, monthday = day.strftime('%Y'), day.strftime('%m%d')
+            kaiji = '%02d' % (1 + (day_index // 8) % 99)
+            nichiji = '%02d' % (1 + day_index % 8)
+
+            for jyo in range(jyo_num):
+                for racenum in range(min(race_per_jyo, self.races_per_day - jyo * race_per_jyo)):
+                    surface = self.rnd.choice(len(SurfaceMix.surface_list), p=SurfaceMix.share())
+                    field_size = int(self.rnd.integers(self.field_min, self.field_max + 1))
+
+                    id = (year, monthday, '%02d' % (jyo + 1), kaiji, nichiji, '%02d' % (racenum + 1))
+                    entry_list = self.__race(surface, field_size, day_index, year + monthday)
+                    writer.write_race(id, SurfaceMix.trackcd(surface, self.rnd), entry_list)
+
+                    race_num += 1
+                    entry_num += field_size
+
+        writer.close(self.horse_pool.birthdate_dict)
+
+        return race_num, entry_num
+
+class Option:
+    @classmethod
+    def get(self, name, default):
+        return type(default)(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2 or sys.argv[1].startswith('--')):
+        print('usage: synthetic_history.py <history.db|history.npz> [--fromyear 1990] [--toyear 2019] [--races-per-day 36] [--scale 1]')
+        print('                            [--field-min 8] [--field-max 18] [--career-mean 15] [--scratch-rate 0.02] [--seed 0]')
+        sys.exit(0)
+
+    output = sys.argv[1]
+    races_per_day = int(Option.get('--races-per-day', 36) * Option.get('--scale', 1.0))
+
+    writer = SnapshotHistoryWriter(output) if output.endswith('.npz') else SqliteHistoryWriter(output)
+    generator = HistoryGenerator(Option.get('--fromyear', 1990), Option.get('--toyear', 2019), races_per_day,
+                                 Option.get('--field-min', 8), Option.get('--field-max', 18),
+                                 Option.get('--career-mean', 15.0), Option.get('--scratch-rate', 0.02), Option.get('--seed', 0))
+    race_num, entry_num = generator.generate(writer)
+
+    print('%d races, %d entries written to %s' % (race_num, entry_num, output))
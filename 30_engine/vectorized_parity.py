@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import sys
+import contextlib
+import importlib.util
+import numpy as np
+
+directory_list = ['10_shiba_tan', '11_dirt_tan', '12_syogai_tan', '20_shibaonly', '21_dirtonly']
+
+class Outcome:
+    # what RatingWriter would store: the rounded ratings (and diffs for 20/21), or the error raised
+    @classmethod
+    def generate(self, module, estimate, rating_list, kakuteijyuni_list):
+        try:
+            # both paths print the field before raising on a missing winner
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = estimate(rating_list, kakuteijyuni_list)
+        except Exception as e:
+            return None, '%s: %s' % (type(e).__name__, e)
+
+        value_list_list = result if isinstance(result, tuple) else (result,)
+        stored = tuple(tuple(module.StoredRating.generate(value) for value in value_list) for value_list in value_list_list)
+        return result, stored
+
+class VectorizedParityCheck:
+    # random fields through estimate (the loop) and estimate_vectorized of each directory
+    def __init__(self, field_num, seed=0):
+        self.field_num = field_num
+        self.random = np.random.default_rng(seed)
+
+    def __field(self):
+        # one field in three has 1-3 starters, the rest 4-18
+        if self.random.random() < 1 / 3:
+            entry_num = int(self.random.integers(1, 4))
+        else:
+            entry_num = int(self.random.integers(4, 19))
+        rating_list = [int(r) for r in self.random.integers(800, 2200, entry_num)]
+        order = self.random.permutation(entry_num) + 1
+
+        # dead heats at any place, the winner included
+        if entry_num > 1 and self.random.random() < 0.2:
+            tie = int(self.random.integers(1, entry_num))
+            order[order == tie + 1] = tie
+        kakuteijyuni_list = ['%02d' % o for o in order]
+
+        # scratched entries carry place '00' and are dropped like RaceReader does; the places
+        # left keep their gaps, and a dropped winner leaves a field both paths must reject
+        if self.random.random() < 0.15:
+            scratched = self.random.random(entry_num) < 0.2
+            kakuteijyuni_list = ['00' if s else jyuni for s, jyuni in zip(scratched, kakuteijyuni_list)]
+            keep = [jyuni != '00' or self.random.random() < 0.5 for jyuni in kakuteijyuni_list]
+            rating_list = [rating for rating, k in zip(rating_list, keep) if k]
+            kakuteijyuni_list = [jyuni for jyuni, k in zip(kakuteijyuni_list, keep) if k]
+
+        return rating_list, kakuteijyuni_list
+
+    def __load(self, directory):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', directory, 'rating_calculator.py')
+        spec = importlib.util.spec_from_file_location('rating_calculator_%s' % directory[:2], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def process(self):
+        field_list = [self.__field() for _ in range(self.field_num)]
+        field_list = [field for field in field_list if field[0]]
+        mismatch_dict = dict()
+
+        for directory in directory_list:
+            module = self.__load(directory)
+            calculator = module.RatingCalculator
+            calculator.vectorized = False
+            stored_mismatch = 0
+            exact_mismatch = 0
+
+            for rating_list, kakuteijyuni_list in field_list:
+                expected, expected_stored = Outcome.generate(module, calculator.estimate, rating_list, kakuteijyuni_list)
+                actual, actual_stored = Outcome.generate(module, calculator.estimate_vectorized, rating_list, kakuteijyuni_list)
+                stored_mismatch += expected_stored != actual_stored
+                exact_mismatch += expected != actual
+
+            mismatch_dict[directory] = (stored_mismatch, exact_mismatch, len(field_list))
+
+        return mismatch_dict
+
+if __name__ == "__main__":
+    field_num = int(sys.argv[sys.argv.index('--fields') + 1]) if '--fields' in sys.argv else 10000
+    seed = int(sys.argv[sys.argv.index('--seed') + 1]) if '--seed' in sys.argv else 0
+
+    mismatch_dict = VectorizedParityCheck(field_num, seed).process()
+    for directory, (stored_mismatch, exact_mismatch, checked_num) in mismatch_dict.items():
+        print('%-18s %d / %d fields differ in the stored rating (%d in the raw value)' % (directory, stored_mismatch, checked_num, exact_mismatch))
+
+    # only the stored values decide; the raw floats are reported for information
+    sys.exit(1 if any(stored_mismatch for stored_mismatch, _, _ in mismatch_dict.values()) else 0)
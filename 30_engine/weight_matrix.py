@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import importlib.util
+import numpy as np
+
+class Place:
+    # rows of a weight matrix: the place of the rated horse
+    first, second, third, other = range(4)
+    code_list = ['01', '02', '03']
+
+    @classmethod
+    def generate(self, jyuni):
+        place = np.full(len(jyuni), self.other)
+        for index, code in enumerate(self.code_list):
+            place[jyuni == code] = index
+        return place
+
+class WeightMatrixCalculator:
+    # every RatingCalculator is a sum of K * (actual - expect) terms, and which terms a horse gets
+    # only depends on its place. k_weight[place, column] holds the K of each term:
+    #   columns 0-2: against the 1st/2nd/3rd place holder alone, actual 0
+    #   column 3:    against the whole field except ties, actual match_num - place for the
+    #                top three and the number of beaten opponents otherwise (always when beaten_all)
+    # a zero K means the term is absent. The terms are added in column order, onto the rating
+    # (on_rating) or into the diff first, which is how the original loops associate them
+    def __init__(self, name, k_weight, beaten_all=False, holder='last', normalized=False, on_rating=True, requires_winner=True):
+        self.name = name
+        self.k_weight = np.array(k_weight, dtype=np.float64)
+        self.beaten_all = beaten_all
+        self.holder = holder
+        self.normalized = normalized
+        self.on_rating = on_rating
+        self.requires_winner = requires_winner
+
+    def __holder_index(self, jyuni, code):
+        # the loops keep the last holder of a place, except the winner-only one which stops at the first
+        index = np.flatnonzero(jyuni == code)
+        if not len(index):
+            return None
+        return index[0] if self.holder == 'first' else index[-1]
+
+    def estimate(self, rating_list, kakuteijyuni_list, strength_list=None):
+        assert(len(rating_list) == len(kakuteijyuni_list))
+
+        rating = np.array(rating_list, dtype=np.float64)
+        jyuni = np.array(kakuteijyuni_list)
+        match_num = len(rating_list)
+        place = Place.generate(jyuni)
+
+        holder_list = [self.__holder_index(jyuni, code) for code in Place.code_list]
+
+        if self.requires_winner and (holder_list[Place.first] is None or rating[holder_list[Place.first]] == 0):
+            print('invalid data')
+            print(rating_list)
+            print(kakuteijyuni_list)
+            raise RuntimeError('invalid data')
+
+        if self.normalized and match_num < 2:
+            raise RuntimeError('single starter')
+
+        if strength_list is None:
+            # float_power (unlike np.power) goes through libm pow, same as the loop implementation
+            expect = lambda rating_op, rating: 1.0 / (1 + np.float_power(10.0, (rating_op - rating) / 400.0 ))
+            operand, missing = rating, 0.0
+        else:
+            # q = 10**(r/400) kept by RatingState; a missing 2nd/3rd place counts as rating 0, whose q is 1
+            expect = lambda strength_op, strength: strength / (strength + strength_op)
+            operand, missing = np.array(strength_list, dtype=np.float64), 1.0
+
+        k_weight = self.k_weight[place]
+
+        # expect_matrix[i, c]: expectation of horse i in term c, the field column summed
+        # left to right like the loops; actual_matrix likewise
+        expect_matrix = np.zeros((match_num, 4))
+        actual_matrix = np.zeros((match_num, 4))
+
+        for column, holder in enumerate(holder_list):
+            expect_matrix[:, column] = expect(operand[holder] if holder is not None else missing, operand)
+
+        match_mask = jyuni[:, None] != jyuni[None, :]
+        expect_matrix[:, 3] = np.add.accumulate(np.where(match_mask, expect(operand[None, :], operand[:, None]), 0.0), axis=1)[:, -1]
+
+        if self.beaten_all:
+            actual_matrix[:, 3] = (jyuni[:, None] < jyuni[None, :]).sum(axis=1)
+        else:
+            actual_matrix[:, 3] = match_num - 1 - place
+            other = place == Place.other
+            if np.any(other & (k_weight[:, 3] != 0)):
+                order = np.array([int(j) for j in kakuteijyuni_list])
+                actual_matrix[other, 3] = ((order[:, None] < order[None, :]) & match_mask).sum(axis=1)[other]
+
+        # the masked product: K times (actual - expect), absent terms are exact zeros
+        term = np.where(k_weight != 0, k_weight * (actual_matrix - expect_matrix), 0.0)
+        if self.normalized:
+            term = term / (match_num - 1)
+
+        if self.on_rating:
+            new_rating = np.add.accumulate(np.column_stack((rating, term)), axis=1)[:, -1]
+            rating_diff = new_rating - rating
+        else:
+            rating_diff = np.add.accumulate(term, axis=1)[:, -1]
+            new_rating = rating + rating_diff
+
+        return new_rating.tolist(), rating_diff.tolist()
+
+calculator_registry = {
+    'indiscriminate': WeightMatrixCalculator('indiscriminate',
+        [[0, 0, 0, 32],
+         [0, 0, 0, 32],
+         [0, 0, 0, 32],
+         [0, 0, 0, 32]], beaten_all=True, normalized=True, requires_winner=False),
+    'winner': WeightMatrixCalculator('winner',
+        [[0, 0, 0, 32],
+         [32, 0, 0, 0],
+         [32, 0, 0, 0],
+         [32, 0, 0, 0]], holder='first'),
+    'top_three': WeightMatrixCalculator('top_three',
+        [[0, 0, 0, 16],
+         [16, 0, 0, 8],
+         [16, 8, 0, 4],
+         [16, 8, 4, 0]]),
+    'top_three_other': WeightMatrixCalculator('top_three_other',
+        [[0, 0, 0, 16],
+         [16, 0, 0, 12],
+         [16, 12, 0, 8],
+         [16, 12, 8, 4]], on_rating=False),
+}
+
+directory_scheme = {
+    '02_indiscriminate': 'indiscriminate',
+    '03_shibaonly': 'indiscriminate',
+    '04_dirtonly': 'indiscriminate',
+    '05_shiba_tan': 'winner',
+    '06_dirt_tan': 'winner',
+    '10_shiba_tan': 'top_three',
+    '11_dirt_tan': 'top_three',
+    '12_syogai_tan': 'top_three',
+    '20_shibaonly': 'top_three_other',
+    '21_dirtonly': 'top_three_other',
+}
+
+class WeightMatrixRegistry:
+    @classmethod
+    def generate(self, table):
+        # uma_rating_NN is written by the NN_* directory
+        for directory, scheme in directory_scheme.items():
+            if directory[:2] == table[-2:]:
+                return calculator_registry[scheme]
+        raise KeyError(table)
+
+class ParityCheck:
+    # random fields through each directory's own RatingCalculator and its registry scheme
+    def __init__(self, field_num, seed=0):
+        self.field_num = field_num
+        self.random = np.random.default_rng(seed)
+
+    def __field(self):
+        entry_num = int(self.random.integers(2, 19))
+        rating_list = [int(r) for r in self.random.integers(800, 2200, entry_num)]
+        order = self.random.permutation(entry_num) + 1
+        # dead heats and a missing 2nd/3rd place now and then, never a missing winner
+        if entry_num > 2 and self.random.random() < 0.2:
+            tie = int(self.random.integers(1, min(entry_num, 4)))
+            order[order == tie + 1] = tie
+        return rating_list, ['%02d' % o for o in order]
+
+    def __load(self, directory):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', directory, 'rating_calculator.py')
+        spec = importlib.util.spec_from_file_location('rating_calculator_%s' % directory[:2], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.RatingCalculator
+
+    def process(self):
+        field_list = [self.__field() for _ in range(self.field_num)]
+        mismatch_dict = dict()
+
+        for directory, scheme in directory_scheme.items():
+            original = self.__load(directory)
+            calculator = calculator_registry[scheme]
+            mismatch = 0
+
+            for rating_list, kakuteijyuni_list in field_list:
+                expected = original.estimate(rating_list, kakuteijyuni_list)
+                new_rating_list, rating_diff_list = calculator.estimate(rating_list, kakuteijyuni_list)
+                # 20/21 return the diffs as well, the others only the new ratings
+                if isinstance(expected, tuple):
+                    mismatch += expected != (new_rating_list, rating_diff_list)
+                else:
+                    mismatch += expected != new_rating_list
+
+            mismatch_dict[directory] = mismatch
+
+        return mismatch_dict
+
+if __name__ == "__main__":
+    field_num = int(sys.argv[sys.argv.index('--fields') + 1]) if '--fields' in sys.argv else 10000
+
+    mismatch_dict = ParityCheck(field_num).process()
+    for directory, mismatch in mismatch_dict.items():
+        print('%-18s %-16s %d / %d fields differ' % (directory, directory_scheme[directory], mismatch, field_num))
+
+    sys.exit(1 if any(mismatch_dict.values()) else 0)
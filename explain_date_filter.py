@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import psycopg2
+import time
+
+concat_older = lambda yearmonthday: "concat(year, monthday)>='%s'" % yearmonthday
+concat_newer = lambda yearmonthday: "concat(year, monthday)<='%s'" % yearmonthday
+concat_until = lambda yearmonthday: "concat(year, monthday)<'%s'" % yearmonthday
+rowvalue_older = lambda yearmonthday: "(year, monthday)>=('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
+rowvalue_newer = lambda yearmonthday: "(year, monthday)<=('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
+rowvalue_until = lambda yearmonthday: "(year, monthday)<('%s', '%s')" % (yearmonthday[:4], yearmonthday[4:])
+
+query_id_list = lambda older, newer, fromyearmonthday, toyearmonthday :\
+                "select year, monthday, jyocd, kaiji, nichiji, racenum from n_race "\
+                "where datakubun='7' AND %s AND %s "\
+                "order by year, monthday, jyocd, nichiji, racenum"\
+                % (older(fromyearmonthday), newer(toyearmonthday))
+query_latest_rating = lambda until, tablename, yearmonthday :\
+                "select distinct on (kettonum) kettonum, rating from %s "\
+                "where %s "\
+                "order by kettonum, year desc, monthday desc"\
+                % (tablename, until(yearmonthday))
+
+class Explainer:
+    @classmethod
+    def run(self, title, query, connection):
+        with connection.cursor() as cur:
+            start = time.time()
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query)
+            rows = cur.fetchall()
+            elapsed = time.time() - start
+
+        print('== %s (%.3f sec)' % (title, elapsed))
+        print(query)
+        for row, in rows:
+            print('    ' + row)
+        print()
+
+        return elapsed
+
+if __name__ == "__main__":
+
+    if (len(sys.argv) != 4):
+        print('usage: explain_date_filter.py <tablename> <from yyyymmdd> <to yyyymmdd>')
+        sys.exit(0)
+
+    tablename = sys.argv[1]
+    fromyearmonthday = sys.argv[2]
+    toyearmonthday = sys.argv[3]
+
+    try:
+        connection_raw  = psycopg2.connect(os.environ.get('DATABASE_URL_SRC'))
+    except:
+        print('psycopg2: opening connection 01 faied')
+        sys.exit(0)
+
+    try:
+        connection_processed = psycopg2.connect(os.environ.get('DB_UMA_PROCESSED'))
+    except:
+        print('psycopg2: opening connection 02 faied')
+        sys.exit(0)
+
+    result = list()
+
+    before = Explainer.run('n_race id list: concat', query_id_list(concat_older, concat_newer, fromyearmonthday, toyearmonthday), connection_raw)
+    after = Explainer.run('n_race id list: row value', query_id_list(rowvalue_older, rowvalue_newer, fromyearmonthday, toyearmonthday), connection_raw)
+    result.append(('n_race id list', before, after))
+
+    before = Explainer.run('%s latest rating: concat' % tablename, query_latest_rating(concat_until, tablename, fromyearmonthday), connection_processed)
+    after = Explainer.run('%s latest rating: row value' % tablename, query_latest_rating(rowvalue_until, tablename, fromyearmonthday), connection_processed)
+    result.append(('%s latest rating' % tablename, before, after))
+
+    connection_processed.close()
+    connection_raw.close()
+
+    for title, before, after in result:
+        print('%-32s before: %8.3f sec  after: %8.3f sec' % (title, before, after))
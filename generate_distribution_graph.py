@@ -1,90 +1,213 @@
 #!/usr/bin/env python3
 
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import sys
 import os
-import psycopg2
-import datetime
-from tqdm import tqdm
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '30_engine'))
+from storage import Storage
+from race_source import SelectPhrase
+from rating_table import LatestRatingReference
+from rating_index import RatingIndexReader
+
+class OneYearFilter:
+    @classmethod
+    def generate_phrase(cls, yyyymmdd):
+        # strictly inside the year before yyyymmdd, both ends excluded
+        return " (year, monthday)<('%s', '%s') AND (year, monthday)>('%d', '%s')" % (yyyymmdd[:4], yyyymmdd[4:], int(yyyymmdd[:4]) - 1, yyyymmdd[4:])
+
+class ActiveHorseReference:
+    __cols = 'kettonum'
+
+    def __init__(self, yyyymmdd):
+        # horses that appeared in the past year and have an n_uma record
+        self.table      = 'n_uma_race JOIN n_uma USING (kettonum)'
+        self.cols       = 'DISTINCT ' + ActiveHorseReference.__cols
+        self.conditions = OneYearFilter.generate_phrase(yyyymmdd)
+        self.order      = ''
+        self.limit      = ''
+
+class ActiveRatingReference:
+    __cols = 'kettonum, rating'
+
+    def __init__(self, table, yyyymmdd, dialect='postgresql'):
+        # as-of join of the active horses against the (kettonum, year, monthday) index
+        active = '(%s) AS active' % SelectPhrase.generate(ActiveHorseReference(yyyymmdd))
+        until = " (year, monthday)<('%s', '%s')" % (yyyymmdd[:4], yyyymmdd[4:])
+
+        if dialect == 'sqlite':
+            self.table      = '(SELECT kettonum, rating, row_number() OVER (PARTITION BY kettonum ORDER BY year DESC, monthday DESC) AS latest'\
+                              ' FROM %s JOIN %s USING (kettonum) WHERE%s)' % (active, table, until)
+            self.cols       = ActiveRatingReference.__cols
+            self.conditions = 'latest=1'
+            self.order      = ''
+            self.limit      = ''
+            return
+
+        self.table      = '%s JOIN %s USING (kettonum)' % (active, table)
+        self.cols       = 'DISTINCT ON (kettonum) ' + ActiveRatingReference.__cols
+        self.conditions = until
+        self.order      = 'kettonum, year DESC, monthday DESC'
+        self.limit      = ''
+
+    @classmethod
+    def index(self, colname):
+        return self.__cols.strip().split(', ').index(colname)
+
+class DistributionReader:
+    @classmethod
+    def load_data(self, table, yyyymmdd, connection_raw, connection_processed, same_database):
+        if same_database:
+            with connection_processed.cursor() as cur:
+                cur.execute(SelectPhrase.generate(ActiveRatingReference(table, yyyymmdd, connection_processed.dialect)))
+                return [row[ActiveRatingReference.index('rating')] for row in cur.fetchall()]
+
+        # n_uma_race and the rating table live in different databases: one set-based query on each side
+        with connection_raw.cursor() as cur:
+            cur.execute(SelectPhrase.generate(ActiveHorseReference(yyyymmdd)))
+            active_set = set(row[0] for row in cur.fetchall())
+
+        with connection_processed.cursor() as cur:
+            cur.execute(SelectPhrase.generate(LatestRatingReference(table, yyyymmdd, connection_processed.dialect)))
+            return [rating for kettonum, rating in cur.fetchall() if kettonum in active_set]
+
+class IndexedDistributionReader:
+    @classmethod
+    def load_data(self, table, yyyymmdd, connection_raw, connection_processed):
+        with connection_raw.cursor() as cur:
+            cur.execute(SelectPhrase.generate(ActiveHorseReference(yyyymmdd)))
+            kettonum_list = [row[0] for row in cur.fetchall()]
+
+        rating_index = RatingIndexReader.load_data(table, connection_processed, yyyymmdd)
+        kettonum_array, rating_array = rating_index.get_all(yyyymmdd, kettonum_list)
+
+        return rating_array.tolist()
+
+class RatingSweepReference:
+    __cols = 'kettonum, year, monthday, rating'
+
+    def __init__(self, table, toyearmonthday):
+        self.table      = table
+        self.cols       = RatingSweepReference.__cols
+        self.conditions = " (year, monthday)<('%s', '%s')" % (toyearmonthday[:4], toyearmonthday[4:])
+        self.order      = 'year ASC, monthday ASC, jyocd ASC, nichiji ASC, racenum ASC, kaiji ASC'
+        self.limit      = ''
+
+class AppearanceReference:
+    __cols = 'kettonum, year, monthday'
+
+    def __init__(self, fromyyyymmdd, toyyyymmdd):
+        self.table      = 'n_uma_race JOIN n_uma USING (kettonum)'
+        self.cols       = AppearanceReference.__cols
+        # from the start of the first date's one-year window up to the last date
+        self.conditions = " (year, monthday)>('%d', '%s') AND (year, monthday)<('%s', '%s')" % (int(fromyyyymmdd[:4]) - 1, fromyyyymmdd[4:], toyyyymmdd[:4], toyyyymmdd[4:])
+        self.order      = 'year ASC, monthday ASC'
+        self.limit      = ''
+
+class DistributionSweep:
+    itersize = 50000
+
+    @classmethod
+    def __stream(self, name, reference, connection):
+        with connection.cursor(name) as cur:
+            cur.itersize = self.itersize
+            cur.execute(SelectPhrase.generate(reference))
+            for kettonum, year, monthday, *rest in cur:
+                yield (year + monthday, kettonum) + tuple(rest)
+
+    @classmethod
+    def load_data(self, table, yyyymmdd_list, connection_raw, connection_processed):
+        # one chronological pass over both histories; each date takes the state reached so far
+        yyyymmdd_list = sorted(yyyymmdd_list)
+        rating_stream = self.__stream('rating_sweep_cursor', RatingSweepReference(table, yyyymmdd_list[-1]), connection_processed)
+        appearance_stream = self.__stream('appearance_sweep_cursor', AppearanceReference(yyyymmdd_list[0], yyyymmdd_list[-1]), connection_raw)
+
+        latest_rating = dict()
+        last_seen = dict()
+        rating_row = next(rating_stream, None)
+        appearance_row = next(appearance_stream, None)
+
+        ratings_dict = dict()
+        for yyyymmdd in yyyymmdd_list:
+            while rating_row is not None and rating_row[0] < yyyymmdd:
+                latest_rating[rating_row[1]] = rating_row[2]
+                rating_row = next(rating_stream, None)
+
+            while appearance_row is not None and appearance_row[0] < yyyymmdd:
+                last_seen[appearance_row[1]] = appearance_row[0]
+                appearance_row = next(appearance_stream, None)
+
+            lower = '%d%s' % (int(yyyymmdd[:4]) - 1, yyyymmdd[4:])
+            ratings_dict[yyyymmdd] = [latest_rating[kettonum] for kettonum, seen in last_seen.items() if seen > lower and kettonum in latest_rating]
+
+        return ratings_dict
+
+class DateRange:
+    @classmethod
+    def generate(self, fromyyyymmdd, toyyyymmdd):
+        # yearly steps keeping month and day, like the 19950000.png - 20190000.png series
+        return ['%04d%s' % (year, fromyyyymmdd[4:]) for year in range(int(fromyyyymmdd[:4]), int(toyyyymmdd[:4]) + 1)]
+
+def render_distribution(yyyymmdd, ratings, outdir='.'):
+    fig = plt.figure()
+    ax = fig.add_subplot(1,1,1)
+
+    ax.hist(ratings, bins=200)
+    ax.set_title('Rating appearance in the past year at %s' % yyyymmdd)
+    ax.set_xlabel('rating')
+    ax.set_ylabel('freq')
+    fig.savefig(os.path.join(outdir, "%s.png" % yyyymmdd))
+    plt.close(fig)
+
+    return yyyymmdd, len(ratings)
 
 if __name__ == "__main__":
 
-    if (len(sys.argv) != 3):
-        print('usage: show_ranking.py <tablename> <yyyymmdd>')
+    if (len(sys.argv) < 3):
+        print('usage: generate_distribution_graph.py <tablename> <yyyymmdd> [--as-of-index]')
+        print('       generate_distribution_graph.py <tablename> <yyyymmdd> <yyyymmdd> ... [--outdir <dir>]')
+        print('       generate_distribution_graph.py <tablename> --range <from yyyymmdd> <to yyyymmdd> [--outdir <dir>]')
+        sys.exit(0)
 
     tablename = sys.argv[1]
-    yyyymmdd = sys.argv[2]
-
-    fromyear = str(int(yyyymmdd[:4]) - 1)
-    fromdate = yyyymmdd[4:]
+    outdir = sys.argv[sys.argv.index('--outdir') + 1] if '--outdir' in sys.argv else '.'
+    if '--range' in sys.argv:
+        yyyymmdd_list = DateRange.generate(sys.argv[sys.argv.index('--range') + 1], sys.argv[sys.argv.index('--range') + 2])
+    else:
+        yyyymmdd_list = [arg for arg in sys.argv[2:] if arg.isdigit()]
 
     try:
-        connection_raw  = psycopg2.connect(os.environ.get('DATABASE_URL_SRC'))
+        connection_raw  = Storage.connect(os.environ.get('DATABASE_URL_SRC'))
     except:
-        print('psycopg2: opening connection 01 faied')
+        print('storage: opening connection 01 faied')
         sys.exit(0)
 
     try:
-        connection_processed = psycopg2.connect(os.environ.get('DB_UMA_PROCESSED'))
+        connection_processed = Storage.connect(os.environ.get('DB_UMA_PROCESSED'))
     except:
-        print('psycopg2: opening connection faied')
+        print('storage: opening connection faied')
         sys.exit(0)
 
-    query_ketto_oneyear = "select kettonum from n_uma_race "\
-                      "where (year<'%s' OR (year='%s' AND monthday<'%s')) "\
-                      "AND (year>'%d' OR (year='%d' AND monthday>'%s')) "\
-                      "order by year desc, monthday desc "\
-                      % (yyyymmdd[:4], yyyymmdd[:4], yyyymmdd[4:], int(yyyymmdd[:4]) - 1, int(yyyymmdd[:4]) - 1, yyyymmdd[4:])
-    query_birthday= lambda kettonum : "select kettonum, birthdate from n_uma where kettonum='%s'" % (kettonum,)
-    query_rating = lambda kettonum : "select year, monthday, rating from %s "\
-               "where kettonum='%s' AND (year<'%s' OR (year='%s' AND monthday<'%s'))"\
-               "order by year desc, monthday desc "\
-               % (tablename, kettonum, yyyymmdd[:4], yyyymmdd[:4], yyyymmdd[4:])
-
-    with connection_raw.cursor() as cur:
-        print(query_ketto_oneyear)
-        cur.execute(query_ketto_oneyear)
-        rows = cur.fetchall()
-
-        kettonum_list = list()
-        for row, in rows:
-            kettonum_list.append(row)
-        kettonum_list_nodup = list(set(kettonum_list))
-
-        print(len(kettonum_list)) 
-        print(len(kettonum_list_nodup)) 
-
-    kettonum_birthdate_list = list()
-    for kettonum in tqdm(kettonum_list_nodup):
-        query = query_birthday(kettonum)
-        with connection_raw.cursor() as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-
-        if rows:
-            kettonum_birthdate_list.append((kettonum, rows[0][0]))
-
-    ratings = list()
-    for kettonum, birthdate in tqdm(kettonum_birthdate_list):
-        query = query_rating(kettonum)
-        with connection_processed.cursor('rating') as cur:
-            cur.execute(query)
-            rating_list = cur.fetchall()
-
-        if rating_list:
-            ratings.append(rating_list[0][2])
+    start = time.time()
+    if len(yyyymmdd_list) > 1:
+        ratings_dict = DistributionSweep.load_data(tablename, yyyymmdd_list, connection_raw, connection_processed)
+    elif '--as-of-index' in sys.argv:
+        ratings_dict = {yyyymmdd_list[0]: IndexedDistributionReader.load_data(tablename, yyyymmdd_list[0], connection_raw, connection_processed)}
+    else:
+        same_database = os.environ.get('DATABASE_URL_SRC') == os.environ.get('DB_UMA_PROCESSED')
+        ratings_dict = {yyyymmdd_list[0]: DistributionReader.load_data(tablename, yyyymmdd_list[0], connection_raw, connection_processed, same_database)}
+    print('%d dates loaded in %.3f sec' % (len(ratings_dict), time.time() - start))
 
     connection_processed.close()
     connection_raw.close()
 
-    fig = plt.figure()
-    ax = fig.add_subplot(1,1,1)
-
-    ax.hist(ratings, bins=200)
-    ax.set_title('Rating appearance in the past year at %s' % yyyymmdd)
-    ax.set_xlabel('rating')
-    ax.set_ylabel('freq')
-    fig.show()
-    fig.savefig("%s.png" % yyyymmdd)
-
+    with ProcessPoolExecutor() as executor:
+        future_list = [executor.submit(render_distribution, yyyymmdd, ratings, outdir) for yyyymmdd, ratings in ratings_dict.items()]
+        for future in future_list:
+            yyyymmdd, horse_num = future.result()
+            print('%s.png: %d horses' % (yyyymmdd, horse_num))
@@ -3,10 +3,12 @@
 import numpy as np
 import sys
 import os
-import psycopg2
 import datetime
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '30_engine'))
+from storage import Storage
+
 class SelectPhrase:
     @classmethod
     def generate(self, reference):
@@ -52,9 +54,9 @@ if __name__ == "__main__":
         print('usage: show_ranking.py <tablename>')
 
     try:
-        connection_processed = psycopg2.connect(os.environ.get('DB_UMA_PROCESSED'))
+        connection_processed = Storage.connect(os.environ.get('DB_UMA_PROCESSED'))
     except:
-        print('psycopg2: opening connection faied')
+        print('storage: opening connection faied')
         sys.exit(0)
 
     try: